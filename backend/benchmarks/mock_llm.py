@@ -0,0 +1,91 @@
+"""OpenAI 兼容的模拟模型服务，供压测使用。
+
+    python -m benchmarks.mock_llm --port 9100 --latency 0.2 --token-delay 0.01 --tokens 50
+
+只实现 POST /v1/chat/completions（含 stream=true）。回复由固定数量的 token 组成，
+首个 token 前等待 --latency 秒，之后每个 token 间隔 --token-delay 秒，模拟真实模型的首字延迟和生成速度。
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+class MockSettings:
+    latency = 0.0
+    token_delay = 0.0
+    tokens = 50
+
+settings = MockSettings()
+
+def reply_tokens(messages: list) -> list:
+    last = messages[-1]["content"] if messages else ""
+    return [f"{last[:8]}-{i} " for i in range(settings.tokens)]
+
+def chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "mock")
+    tokens = reply_tokens(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if not body.get("stream"):
+        await asyncio.sleep(settings.latency + settings.token_delay * max(len(tokens) - 1, 0))
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        })
+
+    async def events():
+        await asyncio.sleep(settings.latency)
+        yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i and settings.token_delay:
+                await asyncio.sleep(settings.token_delay)
+            yield chunk(completion_id, model, {"content": token})
+        yield chunk(completion_id, model, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+app = Starlette(routes=[Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per reply")
+    args = parser.parse_args(argv)
+
+    settings.latency = args.latency
+    settings.token_delay = args.token_delay
+    settings.tokens = args.tokens
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""API 压测：启动模拟模型和 main:app，按场景并发请求，统计延迟分位数、吞吐和每个请求的 SQL 条数。
+
+    python -m benchmarks.run                                 默认 SQLite 临时库，全部场景
+    python -m benchmarks.run --scenarios chat,chat_stream --concurrency 50 --requests 1000
+    python -m benchmarks.run --database-url postgresql://postgres:pw@localhost/chatbot_bench
+    python -m benchmarks.run --save-baseline                 把结果写入 benchmarks/baseline.json
+    python -m benchmarks.run --compare                       与基线比较，有退化时返回 1
+
+在 backend 目录下运行。每次运行前会执行 manage.py migrate / seed，并通过 /api/users/bulk 创建压测用户。
+SQL 条数来自 /metrics 中的 db_queries_per_request（场景前后的差值），因此服务以单进程运行。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+BENCH_PASSWORD = "bench-password"
+
+QUERY_METRIC = re.compile(r'^db_queries_per_request_(sum|count)\{route="([^"]*)"\} (\S+)$')
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法；values 已排序"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+class Process:
+    """后台子进程，退出时终止"""
+
+    def __init__(self, name: str, command: List[str], env: dict, log_dir: str):
+        self.name = name
+        self.log = open(os.path.join(log_dir, f"{name}.log"), "w")
+        self.proc = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, url: str, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.proc.returncode}, see {self.log.name}")
+            try:
+                httpx.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.name} did not start within {timeout}s, see {self.log.name}")
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.log.close()
+
+def server_env(args, work_dir: str, llm_port: int) -> dict:
+    env = dict(os.environ)
+    env.pop("METRICS_TOKEN", None)
+    env.update({
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "LOCAL_LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "LLM_PROVIDER": "local",
+        "AUTO_MIGRATE": "false",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "LOG_DIR": work_dir,
+        "ADMIN_USERNAME": ADMIN_USERNAME,
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+    })
+    if args.bcrypt_rounds:
+        env["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    return env
+
+class Result:
+    """一个场景的原始测量"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.first_token: List[float] = []
+        self.errors = 0
+        self.error_samples: List[str] = []
+        self.elapsed = 0.0
+        self.queries_per_request: Optional[float] = None
+
+    def error(self, detail: str):
+        self.errors += 1
+        if len(self.error_samples) < 3:
+            self.error_samples.append(detail)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        summary = {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "rps": round(len(latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "db_queries_per_request": self.queries_per_request,
+        }
+        if self.first_token:
+            first_token = sorted(self.first_token)
+            summary["first_token_p50_ms"] = round(percentile(first_token, 50) * 1000, 2)
+            summary["first_token_p95_ms"] = round(percentile(first_token, 95) * 1000, 2)
+        return summary
+
+class VirtualUser:
+    """一个并发的压测客户端，对应一个压测用户，保存当前对话等状态"""
+
+    def __init__(self, index: int, client: httpx.AsyncClient, token: str, admin_token: str):
+        self.index = index
+        self.username = f"bench_user_{index}"
+        self.client = client
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        self.conversation_id: Optional[int] = None
+        self.turns = 0
+        self.sent = 0
+
+    async def new_conversation(self) -> int:
+        response = await self.client.post(
+            "/api/chat/conversations", json={"title": f"bench {self.index}"}, headers=self.headers
+        )
+        response.raise_for_status()
+        self.turns = 0
+        return response.json()["id"]
+
+    async def conversation_for_turn(self, turns_per_conversation: int) -> int:
+        if self.conversation_id is None or self.turns >= turns_per_conversation:
+            self.conversation_id = await self.new_conversation()
+        self.turns += 1
+        return self.conversation_id
+
+    def next_content(self) -> str:
+        # 每条内容不同，避免首轮提问命中回复缓存
+        self.sent += 1
+        return f"benchmark question {self.index}-{self.sent}: how does the connection pool behave under load?"
+
+# 场景：一次操作，返回 None；失败时抛出异常。流式场景另外记录首个 token 的时间
+Scenario = Callable[[VirtualUser, Result, argparse.Namespace], Awaitable[None]]
+
+async def scenario_login(user: VirtualUser, result: Result, args):
+    response = await user.client.post(
+        "/api/auth/login", data={"username": user.username, "password": BENCH_PASSWORD}
+    )
+    response.raise_for_status()
+
+async def scenario_create_conversation(user: VirtualUser, result: Result, args):
+    await user.new_conversation()
+
+async def scenario_chat(user: VirtualUser, result: Result, args):
+    conversation_id = await user.conversation_for_turn(args.turns)
+    response = await user.client.post(
+        f"/api/chat/{conversation_id}/message",
+        json={"content": user.next_content(), "role": "user"},
+        headers=user.headers
+    )
+    response.raise_for_status()
+
+async def scenario_chat_stream(user: VirtualUser, result: Result, args):
+    conversation_id = await user.conversation_for_turn(args.turns)
+    started = time.perf_counter()
+    async with user.client.stream(
+        "POST",
+        f"/api/chat/{conversation_id}/message?stream=true",
+        json={"content": user.next_content(), "role": "user"},
+        headers=user.headers
+    ) as response:
+        response.raise_for_status()
+        first = True
+        async for line in response.aiter_lines():
+            if first and line.startswith("event: token"):
+                result.first_token.append(time.perf_counter() - started)
+                first = False
+            elif line.startswith("event: error"):
+                raise RuntimeError("stream returned an error event")
+
+async def scenario_list_conversations(user: VirtualUser, result: Result, args):
+    response = await user.client.get("/api/conversations/summaries?limit=20", headers=user.headers)
+    response.raise_for_status()
+
+async def scenario_admin_listing(user: VirtualUser, result: Result, args):
+    response = await user.client.get("/api/conversations/admin/summaries?limit=50", headers=user.admin_headers)
+    response.raise_for_status()
+
+SCENARIOS: Dict[str, Scenario] = {
+    "login": scenario_login,
+    "create_conversation": scenario_create_conversation,
+    "chat": scenario_chat,
+    "chat_stream": scenario_chat_stream,
+    "list_conversations": scenario_list_conversations,
+    "admin_listing": scenario_admin_listing,
+}
+
+async def scrape_queries(client: httpx.AsyncClient) -> Dict[str, float]:
+    """所有路由（/metrics 除外）的 db_queries_per_request 的 sum 和 count"""
+    totals = {"sum": 0.0, "count": 0.0}
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    for line in response.text.splitlines():
+        match = QUERY_METRIC.match(line)
+        if match and match.group(2) != "/metrics":
+            totals[match.group(1)] += float(match.group(3))
+    return totals
+
+async def run_scenario(name: str, users: List[VirtualUser], client: httpx.AsyncClient, args) -> Result:
+    scenario = SCENARIOS[name]
+    result = Result(name)
+
+    # 预热：建立连接、完成延迟初始化，不计入结果
+    warmup = Result(name)
+    await asyncio.gather(*(scenario(user, warmup, args) for user in users[:args.warmup]), return_exceptions=True)
+
+    before = await scrape_queries(client)
+    remaining = args.requests
+
+    async def worker(user: VirtualUser):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                await scenario(user, result, args)
+            except Exception as e:
+                result.error(f"{type(e).__name__}: {e}")
+                continue
+            result.latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in users))
+    result.elapsed = time.perf_counter() - started
+
+    after = await scrape_queries(client)
+    requests = after["count"] - before["count"]
+    if requests > 0:
+        result.queries_per_request = round((after["sum"] - before["sum"]) / requests, 2)
+    return result
+
+async def create_users(client: httpx.AsyncClient, count: int) -> tuple:
+    """登录管理员，批量创建压测用户并登录，返回 (管理员 token, 各用户 token)"""
+    admin_token = await login(client, ADMIN_USERNAME, ADMIN_PASSWORD)
+    users = [
+        {"username": f"bench_user_{i}", "password": BENCH_PASSWORD, "email": f"bench_user_{i}@example.com"}
+        for i in range(count)
+    ]
+    response = await client.post(
+        "/api/users/bulk", json={"users": users}, headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    response.raise_for_status()
+    # 已存在的用户（重复使用同一个数据库时）创建失败，仍可直接登录
+    tokens = await asyncio.gather(*(login(client, user["username"], BENCH_PASSWORD) for user in users))
+    return admin_token, tokens
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    response = await client.post("/api/auth/login", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+async def drive(base_url: str, args) -> Dict[str, dict]:
+    limits = httpx.Limits(max_connections=args.concurrency + 5, max_keepalive_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        admin_token, tokens = await create_users(client, args.concurrency)
+        users = [VirtualUser(i, client, token, admin_token) for i, token in enumerate(tokens)]
+        results = {}
+        for name in args.scenarios:
+            result = await run_scenario(name, users, client, args)
+            results[name] = result.summary()
+            print_row(name, results[name])
+            for sample in result.error_samples:
+                print(f"    error: {sample}")
+        return results
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+HEADER = f"{'scenario':<22}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>8}"
+
+def print_row(name: str, summary: dict):
+    queries = summary["db_queries_per_request"]
+    print(
+        f"{name:<22}{summary['requests']:>7}{summary['errors']:>6}{summary['rps']:>9.1f}"
+        f"{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+        f"{'-' if queries is None else format(queries, '.1f'):>8}"
+    )
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """延迟 p95 变慢、吞吐下降超过 tolerance，或每个请求多执行了 SQL 时视为退化"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+        if (
+            previous.get("db_queries_per_request") is not None
+            and current.get("db_queries_per_request") is not None
+            and current["db_queries_per_request"] > previous["db_queries_per_request"] + 0.5
+        ):
+            regressions.append(
+                f"{name}: queries/request {previous['db_queries_per_request']} -> {current['db_queries_per_request']}"
+            )
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{name}: errors {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot API against a mock LLM")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run, in order")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--requests", type=int, default=200, help="operations per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="unrecorded operations per scenario")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per conversation before starting a new one")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout per request (seconds)")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file")
+    parser.add_argument("--base-url", default=None, help="benchmark an already running server instead of booting one")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="mock LLM seconds before the first token")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="mock LLM seconds between tokens")
+    parser.add_argument("--llm-tokens", type=int, default=50, help="mock LLM tokens per reply")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="override BCRYPT_ROUNDS for the server")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this path")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="exit with status 1 if results regress from the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change of p95 and rps")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    processes: List[Process] = []
+    try:
+        base_url = args.base_url
+        if base_url is None:
+            llm_port, api_port = free_port(), free_port()
+            mock_llm = Process("mock_llm", [
+                sys.executable, "-m", "benchmarks.mock_llm", "--port", str(llm_port),
+                "--latency", str(args.llm_latency),
+                "--token-delay", str(args.llm_token_delay),
+                "--tokens", str(args.llm_tokens),
+            ], dict(os.environ), work_dir)
+            processes.append(mock_llm)
+
+            env = server_env(args, work_dir, llm_port)
+            for command in ("migrate", "seed"):
+                subprocess.run([sys.executable, "manage.py", command], cwd=BACKEND_DIR, env=env, check=True,
+                               stdout=subprocess.DEVNULL)
+            api = Process("api", [
+                sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(api_port),
+                "--log-level", "warning", "--no-access-log",
+            ], env, work_dir)
+            processes.append(api)
+            # 模拟模型只接受 POST，GET 返回 405 即表示已启动
+            mock_llm.wait_ready(f"http://127.0.0.1:{llm_port}/v1/chat/completions")
+            base_url = f"http://127.0.0.1:{api_port}"
+            api.wait_ready(f"{base_url}/")
+
+        print(f"Benchmarking {base_url} with {args.concurrency} concurrent users, {args.requests} operations per scenario")
+        print(HEADER)
+        results = asyncio.run(drive(base_url, args))
+    finally:
+        for process in reversed(processes):
+            process.stop()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": (args.database_url or "sqlite").split(":", 1)[0],
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "turns": args.turns,
+            "llm_latency": args.llm_latency,
+            "llm_token_delay": args.llm_token_delay,
+            "llm_tokens": args.llm_tokens,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}")
+            return 1
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changed = [
+            key for key in ("database", "concurrency", "turns", "llm_latency", "llm_token_delay", "llm_tokens")
+            if baseline["meta"].get(key) != report["meta"][key]
+        ]
+        if changed:
+            print(f"Warning: baseline was recorded with different settings ({', '.join(changed)})")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
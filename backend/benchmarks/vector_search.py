@@ -0,0 +1,102 @@
+"""向量检索压测：在临时目录中生成合成向量索引，统计单次检索的延迟分位数和 IVF 的召回率。
+
+    python -m benchmarks.vector_search                        默认 100 万条、256 维
+    python -m benchmarks.vector_search --vectors 3000000 --heavy-share 0.2
+
+在 backend 目录下运行。向量由若干簇加噪声生成；一个“重度用户”拥有 --heavy-share 比例的向量，
+其余向量平均分给 --users 个普通用户。召回率为近似检索的 top-k 与精确检索结果的重合比例。
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.vector_index import VectorIndex  # noqa: E402
+
+HEAVY_USER_ID = 1
+ADD_BATCH = 100000
+
+def synthetic_vectors(rng: np.random.Generator, count: int, dim: int, clusters: np.ndarray) -> np.ndarray:
+    vectors = clusters[rng.integers(0, len(clusters), count)] + rng.normal(0, 0.6 / np.sqrt(dim), (count, dim))
+    vectors = vectors.astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def percentile(samples, p: float) -> float:
+    return float(np.percentile(samples, p)) * 1000
+
+def build(index: VectorIndex, args, rng: np.random.Generator, clusters: np.ndarray):
+    started = time.perf_counter()
+    message_id = 0
+    for start in range(0, args.vectors, ADD_BATCH):
+        n = min(ADD_BATCH, args.vectors - start)
+        heavy = rng.random(n) < args.heavy_share
+        users = np.where(heavy, HEAVY_USER_ID, rng.integers(2, args.users + 2, n))
+        ids = np.arange(message_id + 1, message_id + n + 1)
+        index.add(ids.tolist(), (ids // 20).tolist(), users.tolist(), synthetic_vectors(rng, n, args.dim, clusters))
+        message_id += n
+    index.set_last_message_id(message_id)
+    print(f"built {args.vectors} vectors in {time.perf_counter() - started:.1f}s")
+    if index.needs_training():
+        started = time.perf_counter()
+        index.train()
+        print(f"trained IVF in {time.perf_counter() - started:.1f}s")
+
+def measure(index: VectorIndex, user_id: int, queries: np.ndarray, k: int):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search(user_id, query, k)
+        latencies.append(time.perf_counter() - started)
+        results.append({hit.message_id for hit in hits})
+    return latencies, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector index search benchmark")
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.1, help="share of vectors owned by one user")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    clusters = rng.normal(0, 1, (2000, args.dim)).astype(np.float32)
+    clusters /= np.linalg.norm(clusters, axis=1, keepdims=True)
+    directory = tempfile.mkdtemp(prefix="vector_bench_")
+    try:
+        index = VectorIndex(directory)
+        index.open(args.dim, "bench", writable=True)
+        build(index, args, rng, clusters)
+
+        # 读取方与服务中的只读 worker 一样重新映射文件
+        reader = VectorIndex(directory)
+        reader.open(args.dim, "bench", writable=False)
+        queries = synthetic_vectors(rng, args.queries, args.dim, clusters)
+        print(f"{'user':<8} {'vectors':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'recall':>7}")
+        for label, user_id in (("heavy", HEAVY_USER_ID), ("regular", 2)):
+            measure(reader, user_id, queries[:10], args.k)
+            latencies, approximate = measure(reader, user_id, queries, args.k)
+            size = len(reader._users[user_id].view())
+            centroids, reader._centroids = reader._centroids, None
+            _, exact = measure(reader, user_id, queries, args.k)
+            reader._centroids = centroids
+            recall = np.mean([len(a & e) / max(1, len(e)) for a, e in zip(approximate, exact)])
+            print(
+                f"{label:<8} {size:>9} {percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f}"
+                f" {percentile(latencies, 99):>8.2f} {recall:>7.3f}"
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,150 @@
+import atexit
+import json
 import logging
-import sys
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+
+from metrics import Counter
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json / text
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+# Records waiting for the writer thread; when full, new records are dropped instead of blocking requests
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of DEBUG/INFO records kept per module (file name), e.g. "dependencies=0.01,turns=0.1";
+# WARNING and above are never sampled
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "dependencies=0.01")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+log_records_dropped = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Correlation id of the request (or background job) being handled
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            module, rate = item.split("=", 1)
+            rates[module.strip()] = float(rate)
+    return rates
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id; runs on the calling thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of low-severity records from noisy modules."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
 
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(record.module)
+        return rate is None or random.random() < rate
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        RotatingFileHandler('logs/app.log', maxBytes=10485760, backupCount=5),  # 10MB per file, keep 5 files
-        logging.StreamHandler(sys.stdout)
+# Attributes every LogRecord has; anything else was passed through `extra=`
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", "-")
+        if request_id != "-":
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        elif record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without formatting them.
+
+    Message formatting (msg % args) happens on the writer thread, so callers must pass
+    plain values (strings, numbers, exceptions) as arguments, not objects that may change.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the traceback now; the frames it refers to may be gone by the time it is written
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+def create_handlers():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [
+        RotatingFileHandler(os.path.join(LOG_DIR, "app.log"), maxBytes=10485760, backupCount=5),  # 10MB per file, keep 5 files
+        logging.StreamHandler(sys.stdout),
     ]
-)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+_handlers = create_handlers()
+_queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_queue_handler.addFilter(RequestContextFilter())
+_queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+_listener = None
+
+def start_listener():
+    global _listener
+    _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+def stop_listener():
+    """Flushes queued records; called at exit."""
+    if _listener is not None and _listener._thread is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass
+
+def _restart_in_child():
+    # The writer thread does not survive fork (gunicorn workers): give the child its own queue and thread
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    start_listener()
+
+root = logging.getLogger()
+root.setLevel(LOG_LEVEL)
+root.handlers = [_queue_handler]
+start_listener()
+atexit.register(stop_listener)
+os.register_at_fork(after_in_child=_restart_in_child)
 
 # Create logger
 logger = logging.getLogger('chatbot')
-logger.setLevel(logging.INFO) 
\ No newline at end of file
+logger.setLevel(LOG_LEVEL)
@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from config.logger import logger
+from instrumentation import instrument_engine
+from metrics import REGISTRY, Counter, Family, Gauge, Histogram
 import os
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -15,24 +23,185 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "chatbot_db")
 
-# PostgreSQL connection string
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# PostgreSQL connection string (DATABASE_URL 优先)
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+
+# 同步驱动到异步驱动的映射
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    """将同步连接串转换为对应的异步驱动连接串"""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return str(parsed.set(drivername=drivername))
+
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# 连接池配置（同步和异步引擎各自持有一个连接池）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# 单条语句超时（毫秒），0 表示不限制
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+# 由 gunicorn_conf.py 设置：worker 数，以及整个服务可用的数据库连接数（0 表示未设置）
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+if DB_MAX_CONNECTIONS and not IS_SQLITE:
+    # 每个 worker 有同步、异步两个连接池
+    peak_connections = WEB_CONCURRENCY * 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    if peak_connections > DB_MAX_CONNECTIONS:
+        logger.warning(
+            "%s 个 worker 最多可能打开 %s 个数据库连接，超过 DB_MAX_CONNECTIONS=%s",
+            WEB_CONCURRENCY, peak_connections, DB_MAX_CONNECTIONS
+        )
+
+# 连接池指标
+pool_wait_seconds = {
+    name: Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", labels={"engine": name})
+    for name in ("sync", "async")
+}
+pool_timeouts = {
+    name: Counter("db_pool_timeouts_total", "Pool checkouts that hit DB_POOL_TIMEOUT", labels={"engine": name})
+    for name in ("sync", "async")
+}
+pool_connections = Family(Gauge, "db_pool_connections", "Pooled connections by state", ("engine", "state"))
+
+@contextmanager
+def measure_checkout(pool, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except PoolTimeoutError:
+        pool_timeouts[name].inc()
+        logger.error("Database pool exhausted (%s): %s", name, pool.status())
+        raise
+    finally:
+        pool_wait_seconds[name].observe(time.perf_counter() - start)
+
+class InstrumentedQueuePool(QueuePool):
+    """记录获取连接等待时间的 QueuePool"""
+
+    def _do_get(self):
+        with measure_checkout(self, "sync"):
+            return super()._do_get()
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """记录获取连接等待时间的 AsyncAdaptedQueuePool"""
+
+    def _do_get(self):
+        with measure_checkout(self, "async"):
+            return super()._do_get()
+
+def engine_options(poolclass) -> dict:
+    """根据环境变量生成连接池参数；SQLite 使用 SQLAlchemy 默认连接池"""
+    if IS_SQLITE:
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# SQLite（本地运行）的连接会跨线程池线程使用
+if IS_SQLITE:
+    connect_args = {"check_same_thread": False}
+    async_connect_args = {}
+elif DB_STATEMENT_TIMEOUT_MS > 0:
+    connect_args = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    async_connect_args = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+else:
+    connect_args = {}
+    async_connect_args = {}
+
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite 默认不检查外键，每个连接都需要打开，ON DELETE CASCADE 才会生效"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
 
 try:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args=connect_args,
+        **engine_options(InstrumentedQueuePool)
+    )
+    async_engine = create_async_engine(
+        ASYNC_SQLALCHEMY_DATABASE_URL,
+        connect_args=async_connect_args,
+        **engine_options(InstrumentedAsyncQueuePool)
+    )
+    instrument_engine(engine, "sync")
+    instrument_engine(async_engine.sync_engine, "async")
+    if IS_SQLITE:
+        for sqlite_engine in (engine, async_engine.sync_engine):
+            event.listen(sqlite_engine, "connect", enable_sqlite_foreign_keys)
     logger.info("Successfully connected to PostgreSQL database")
 except Exception as e:
-    logger.error(f"Failed to connect to PostgreSQL database: {str(e)}")
+    logger.error("Failed to connect to PostgreSQL database: %s", e)
     raise
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: 异步会话中提交后不能再隐式懒加载属性
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 Base = declarative_base()
 
+def _pool_stats(pool, name: str) -> dict:
+    stats = {"status": pool.status()}
+    # NullPool / SingletonThreadPool（SQLite）没有计数接口
+    for key in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, key, None)
+        if callable(method):
+            stats[key] = method()
+    stats["timeouts"] = pool_timeouts[name].value
+    stats["wait_seconds"] = pool_wait_seconds[name].snapshot()
+    return stats
+
+def get_pool_stats() -> dict:
+    """当前 worker 中两个连接池的使用情况"""
+    return {
+        "sync": _pool_stats(engine.pool, "sync"),
+        "async": _pool_stats(async_engine.sync_engine.pool, "async"),
+    }
+
+def collect_pool_metrics():
+    for name, stats in get_pool_stats().items():
+        for state in ("checkedin", "checkedout", "overflow"):
+            if state in stats:
+                pool_connections.labels(name, state).set(stats[state])
+
+REGISTRY.add_collector(collect_pool_metrics)
+
 # 数据库依赖
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 异步数据库依赖，供 async def 路由使用，避免同步查询阻塞事件循环
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
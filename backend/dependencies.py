@@ -1,14 +1,17 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 import jwt
 from datetime import datetime, timedelta
 import os
+import time
 from dotenv import load_dotenv
 from config.logger import logger
+from instrumentation import measure_stage
 
 from database import get_db
-from models import User
+from models import User, Role
+from services.cache import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +21,15 @@ SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # 增加token过期时间到60分钟
 
+# 已验证签名的 token -> payload，条目在 token 过期时一同失效
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+token_cache = TTLCache(max_size=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# 用户名 -> 已脱离会话的 User（预加载角色和权限），短时间内复用以省去每个请求的查询
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -28,17 +40,54 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    ttl = exp - time.time() if exp else None
+    token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+def load_user(db: Session, username: str):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    user = db.query(User).options(
+        selectinload(User.roles).selectinload(Role.permissions)
+    ).filter(User.username == username).first()
+    if user is None:
+        return None
+    # 从会话中移出，避免本请求提交后属性过期，缓存的对象可以跨请求读取
+    for role in user.roles:
+        for permission in role.permissions:
+            db.expunge(permission)
+        db.expunge(role)
+    db.expunge(user)
+    user_cache.set(username, user)
+    return user
+
+def invalidate_user(*usernames: str):
+    """用户信息变更后使缓存失效（仅当前 worker，其他 worker 在 USER_CACHE_TTL 内过期）"""
+    for username in usernames:
+        user_cache.pop(username)
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    with measure_stage("auth"):
+        return authenticate_user(db, token)
+
+def authenticate_user(db: Session, token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
-            logger.warning(f"Invalid token: missing username in payload")
+            logger.warning("Invalid token: missing username in payload")
             raise credentials_exception
     except jwt.ExpiredSignatureError:
         logger.warning("Token has expired")
@@ -48,16 +97,16 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     except jwt.InvalidTokenError as e:
-        logger.error(f"Invalid token: {str(e)}")
+        logger.error("Invalid token: %s", e)
         raise credentials_exception
     except Exception as e:
-        logger.error(f"Unexpected error during token validation: {str(e)}")
+        logger.error("Unexpected error during token validation: %s", e)
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == username).first()
+    user = load_user(db, username)
     if user is None:
-        logger.warning(f"User not found: {username}")
+        logger.warning("User not found: %s", username)
         raise credentials_exception
     
-    logger.info(f"User authenticated successfully: {username}")
+    logger.info("User authenticated successfully: %s", username)
     return user 
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""生产环境 gunicorn 配置：gunicorn main:app -c gunicorn_conf.py
+
+每个 worker 是一个 uvicorn 事件循环，async 路由之间互不阻塞；worker 数默认按 CPU 核数计算。
+给出 DB_MAX_CONNECTIONS（整个服务可用的数据库连接数）时，按 worker 数均分到每个 worker 的连接池。
+"""
+import multiprocessing
+import os
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+cores = multiprocessing.cpu_count()
+
+# worker 数：WEB_CONCURRENCY 优先，否则为 CPU 核数 × WORKERS_PER_CORE，不超过 MAX_WORKERS
+workers_per_core = float(os.getenv("WORKERS_PER_CORE", "1"))
+max_workers = env_int("MAX_WORKERS", 0)
+workers = env_int("WEB_CONCURRENCY", max(int(cores * workers_per_core), 2))
+if max_workers:
+    workers = min(workers, max_workers)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}")
+# 先在主进程导入应用再 fork，worker 启动更快且共享只读内存；
+# 数据库连接池在 post_fork 中丢弃，各 worker 建立自己的连接
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# worker 心跳超时；uvicorn worker 的心跳由事件循环发出，长时间的模型调用不会触发
+timeout = env_int("WORKER_TIMEOUT", 120)
+# 收到 SIGTERM / SIGHUP 后等待进行中的请求（包括流式回复）完成的时间，超时后强制结束
+graceful_timeout = env_int("GRACEFUL_TIMEOUT", 60)
+keepalive = env_int("KEEP_ALIVE", 5)
+# 定期重启 worker，限制内存增长；重启同样会等待进行中的请求
+max_requests = env_int("MAX_REQUESTS", 1000)
+max_requests_jitter = env_int("MAX_REQUESTS_JITTER", 50)
+
+# 每个 worker 持有同步、异步两个连接池
+POOLS_PER_WORKER = 2
+
+def pool_sizes(max_connections: int, worker_count: int):
+    """把总连接数均分到每个 worker 的每个连接池，返回 (pool_size, max_overflow)"""
+    per_pool = max(max_connections // (worker_count * POOLS_PER_WORKER), 2)
+    pool_size = max(per_pool // 2, 1)
+    return pool_size, per_pool - pool_size
+
+db_max_connections = env_int("DB_MAX_CONNECTIONS", 0)
+if db_max_connections and not os.getenv("DB_POOL_SIZE"):
+    pool_size, max_overflow = pool_sizes(db_max_connections, workers)
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+
+# 密码哈希进程池按 worker 数分摊 CPU，避免 workers × 核数个 bcrypt 进程争抢
+os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(cores // workers, 1)))
+
+def on_starting(server):
+    server.log.info(
+        "Starting %d uvicorn workers (DB pool %s + %s overflow per engine, %s password hash processes)",
+        workers,
+        os.getenv("DB_POOL_SIZE", "5"),
+        os.getenv("DB_MAX_OVERFLOW", "10"),
+        os.environ["PASSWORD_HASH_WORKERS"],
+    )
+
+def post_fork(server, worker):
+    # 预加载时连接池在主进程中创建，fork 后不能与主进程共用连接
+    from database import engine, async_engine
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
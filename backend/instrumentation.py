@@ -0,0 +1,96 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import Counter, Family, Histogram
+
+# 每个请求执行的查询条数分桶
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+request_duration = Family(
+    Histogram, "http_request_duration_seconds", "HTTP request latency until the response body is sent",
+    ("method", "route", "status")
+)
+stage_duration = Family(
+    Histogram, "request_stage_seconds", "Time a request or chat turn spent in each stage (summed per request)",
+    ("stage",)
+)
+request_queries = Family(
+    Histogram, "db_queries_per_request", "Database statements executed per request or chat turn",
+    ("route",), buckets=QUERY_COUNT_BUCKETS
+)
+db_queries = Family(Counter, "db_queries_total", "Database statements executed", ("engine",))
+db_query_duration = Family(Histogram, "db_query_seconds", "Database statement execution time", ("engine",))
+
+class RequestStats:
+    """一个请求（或 WebSocket 中的一轮对话）累计的各阶段耗时和查询条数。
+
+    保存在 contextvar 中；线程池和子任务复制上下文后仍指向同一个对象。
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.stages: Dict[str, float] = defaultdict(float)
+
+    def observe(self, route: str):
+        for stage, seconds in self.stages.items():
+            stage_duration.labels(stage).observe(seconds)
+        request_queries.labels(route).observe(self.queries)
+
+request_stats_var: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+@contextmanager
+def track_request():
+    """在当前上下文中开始统计，结束后由调用方按路由调用 stats.observe"""
+    stats = RequestStats()
+    token = request_stats_var.set(stats)
+    try:
+        yield stats
+    finally:
+        request_stats_var.reset(token)
+
+def record_stage(stage: str, seconds: float):
+    """计入当前请求的阶段耗时；不在请求中（如后台任务）时直接记录"""
+    stats = request_stats_var.get()
+    if stats is None:
+        stage_duration.labels(stage).observe(seconds)
+    else:
+        stats.stages[stage] += seconds
+
+@contextmanager
+def measure_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def instrument_engine(engine: Engine, name: str):
+    """统计引擎执行的每条语句；异步引擎传入 async_engine.sync_engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        db_queries.labels(name).inc()
+        db_query_duration.labels(name).observe(elapsed)
+        stats = request_stats_var.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.stages["db"] += elapsed
+
+class TimedJSONResponse(JSONResponse):
+    """记录 JSON 编码耗时（serialize 阶段）的默认响应类"""
+
+    def render(self, content) -> bytes:
+        with measure_stage("serialize"):
+            return super().render(content)
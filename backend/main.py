@@ -1,22 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, conversations, chat, roles, users
-import uvicorn
+from fastapi.responses import PlainTextResponse
+from routers import auth, conversations, chat, roles, users, ws
 from config.logger import logger
-from database import engine, Base
-from models import User, Role, Permission, Conversation, Message
-from sqlalchemy.orm import Session
-from database import get_db
-from pydantic import BaseModel
-from typing import List, Optional
-import sqlite3
-import hashlib
-import jwt
-import time
-from datetime import datetime, timedelta
+from database import engine, SessionLocal, get_pool_stats
+from dependencies import get_current_user
+from instrumentation import TimedJSONResponse
+from metrics import REGISTRY
+from middleware import MetricsMiddleware, RequestIdMiddleware
+from migrations import check_schema, upgrade
+import passwords
+from services.llm import close_providers
+from services.retrieval import RETRIEVAL_ENABLED, embedding_indexer
+from services.summary_jobs import summary_workers
+from models import User
 import os
-import json
-import uuid
+import secrets
+
+# 启动时自动迁移并创建默认数据，仅用于单进程开发环境
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+# 设置后 /metrics 需要 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 app = FastAPI(
     title="Chatbot API",
@@ -24,6 +28,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url=None,  # 禁用Swagger文档
     redoc_url=None,  # 禁用ReDoc文档
+    default_response_class=TimedJSONResponse,
 )
 
 # 简化CORS配置
@@ -32,61 +37,76 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
     max_age=3600,
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(conversations.router, prefix="/api/conversations", tags=["conversations"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(ws.router, prefix="/api/chat", tags=["chat"])
 app.include_router(roles.router, prefix="/api/roles", tags=["roles"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 
-@app.on_event("startup")
-async def startup_event():
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
-    
-    # 检查并创建默认角色
-    db = next(get_db())
+def init_db():
+    """开发环境使用：迁移到最新版本并创建默认数据（单进程运行时设置 AUTO_MIGRATE=true）"""
+    from migrations.seed import seed_defaults
+
+    upgrade(engine)
+    db = SessionLocal()
     try:
-        # 检查admin角色是否存在
-        admin_role = db.query(Role).filter(Role.name == "admin").first()
-        if not admin_role:
-            admin_role = Role(name="admin", description="Administrator role")
-            db.add(admin_role)
-            logger.info("Created admin role")
-        
-        # 检查user角色是否存在
-        user_role = db.query(Role).filter(Role.name == "user").first()
-        if not user_role:
-            user_role = Role(name="user", description="Regular user role")
-            db.add(user_role)
-            logger.info("Created user role")
-        
-        db.commit()
-        
-        # 检查admin用户是否存在
-        admin_user = db.query(User).filter(User.username == "admin").first()
-        if not admin_user:
-            from routers.auth import get_password_hash
-            admin_user = User(
-                username="admin",
-                hashed_password=get_password_hash("admin123"),
-                is_admin=True
-            )
-            admin_user.roles.append(admin_role)
-            db.add(admin_user)
-            db.commit()
-            logger.info("Created admin user")
+        seed_defaults(db)
     finally:
         db.close()
 
+@app.on_event("startup")
+async def startup_event():
+    # 建表和初始数据由 python manage.py migrate / seed 完成，这里只检查结构版本
+    if AUTO_MIGRATE:
+        init_db()
+    else:
+        check_schema(engine)
+    
+    # 启动标题生成 worker，并恢复上次未完成的任务
+    await summary_workers.start()
+    # 向量索引：打开本节点的索引文件并在后台为新消息建索引
+    if RETRIEVAL_ENABLED:
+        await embedding_indexer.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await summary_workers.stop()
+    await embedding_indexer.stop()
+    passwords.shutdown()
+    await close_providers()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用聊天机器人API"}
 
+@app.get("/api/system/pool")
+def read_pool_stats(current_user: User = Depends(get_current_user)):
+    """当前 worker 的数据库连接池状态"""
+    if not current_user.is_admin:
+        logger.warning("Unauthorized access attempt to pool stats by: %s", current_user.username)
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return get_pool_stats()
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics(request: Request):
+    """Prometheus 文本格式的指标；每个 worker 单独统计，由抓取方按实例汇总"""
+    authorization = request.headers.get("authorization", "")
+    if METRICS_TOKEN and not secrets.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Not authorized")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import uvicorn
+
+    os.environ.setdefault("AUTO_MIGRATE", "true")
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
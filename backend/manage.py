@@ -0,0 +1,64 @@
+"""数据库管理命令。
+
+    python manage.py migrate [--to VERSION]   执行数据库迁移
+    python manage.py seed                     创建默认角色和管理员
+    python manage.py version                  查看数据库结构版本
+    python manage.py backfill-stats           重新计算所有对话的消息数、最后一条消息和 token 数
+"""
+import argparse
+import sys
+
+from database import SessionLocal, engine
+from migrations import current_version, latest_version, upgrade
+
+def migrate(args):
+    applied = upgrade(engine, target=args.to)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("Database is up to date")
+
+def seed(args):
+    from migrations.seed import seed_defaults
+
+    db = SessionLocal()
+    try:
+        seed_defaults(db)
+    finally:
+        db.close()
+    print("Default roles and admin user are in place")
+
+def version(args):
+    with engine.connect() as conn:
+        print(f"current: {current_version(conn)}, latest: {latest_version()}")
+
+def backfill_stats(args):
+    from services.conversation_stats import backfill
+
+    db = SessionLocal()
+    try:
+        count = backfill(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Recomputed stats for {count} conversations")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chatbot database management")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="apply pending migrations")
+    migrate_parser.add_argument("--to", type=int, default=None, help="stop at this schema version")
+    migrate_parser.set_defaults(func=migrate)
+
+    commands.add_parser("seed", help="create default roles and the admin user").set_defaults(func=seed)
+    commands.add_parser("version", help="show current and latest schema version").set_defaults(func=version)
+
+    backfill_parser = commands.add_parser("backfill-stats", help="recompute denormalized conversation stats")
+    backfill_parser.add_argument("--batch-size", type=int, default=500, help="conversations per transaction")
+    backfill_parser.set_defaults(func=backfill_stats)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
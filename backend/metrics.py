@@ -0,0 +1,207 @@
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (名称后缀, 标签, 值)
+Sample = Tuple[str, Dict[str, str], float]
+
+class Registry:
+    """进程内的指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], None]):
+        """导出前调用，用于刷新由外部状态（如连接池）计算的指标"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        # 同名指标（只是标签不同）合并到一个 HELP / TYPE 下
+        families: Dict[str, Tuple[str, str, List[Sample]]] = {}
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            family = families.setdefault(metric.name, (metric.type, metric.description, []))
+            family[2].extend(metric.samples())
+        lines = []
+        for name, (metric_type, description, samples) in families.items():
+            lines.append(f"# HELP {name} {escape_help(description)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """线程安全的单调递增计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None, register: bool = True):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0.0
+        self._lock = threading.Lock()
+        if register:
+            REGISTRY.register(self)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self) -> List[Sample]:
+        return [("", self.labels, self._value)]
+
+class Gauge:
+    """线程安全的瞬时值"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str = "", labels: Optional[Dict[str, str]] = None, register: bool = True):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0.0
+        self._lock = threading.Lock()
+        if register:
+            REGISTRY.register(self)
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self) -> List[Sample]:
+        return [("", self.labels, self._value)]
+
+class Histogram:
+    """线程安全的累积直方图，每个桶统计小于等于上界的样本数"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str = "",
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        labels: Optional[Dict[str, str]] = None,
+        register: bool = True
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.labels = labels or {}
+        self._counts = [0] * len(self.buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        if register:
+            REGISTRY.register(self)
+
+    def observe(self, value: float):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    self._counts[i] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "buckets": {str(upper): count for upper, count in zip(self.buckets, self._counts)},
+                "count": self._count,
+                "sum": self._sum,
+            }
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            counts, count, total = list(self._counts), self._count, self._sum
+        samples = [
+            ("_bucket", {**self.labels, "le": format_value(upper)}, bucket_count)
+            for upper, bucket_count in zip(self.buckets, counts)
+        ]
+        samples.append(("_bucket", {**self.labels, "le": "+Inf"}, count))
+        samples.append(("_sum", self.labels, total))
+        samples.append(("_count", self.labels, count))
+        return samples
+
+class Family:
+    """一组同名、按标签值区分的指标（如按路由统计的延迟），子指标在第一次使用时创建"""
+
+    def __init__(self, metric_class, name: str, description: str, label_names: Sequence[str], **options):
+        self.metric_class = metric_class
+        self.type = metric_class.type
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.options = options
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values: str):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self.metric_class(
+                        self.name,
+                        self.description,
+                        labels=dict(zip(self.label_names, key)),
+                        register=False,
+                        **self.options
+                    )
+                    self._children[key] = child
+        return child
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            children = list(self._children.values())
+        return [sample for child in children for sample in child.samples()]
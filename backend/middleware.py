@@ -0,0 +1,85 @@
+import re
+import time
+import uuid
+from typing import Callable, Dict
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config.logger import request_id_var
+from instrumentation import request_duration, track_request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# 只接受客户端或网关传入的简单 id，避免把任意内容写进日志
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+class RequestIdMiddleware:
+    """为每个请求设置 request id（沿用 X-Request-ID 请求头或新生成），写入日志并在响应头中返回。
+
+    使用纯 ASGI 实现，不缓冲流式响应。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.lower().encode(), b"").decode("latin-1")
+        request_id = incoming if VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, request_id)
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+# 未匹配任何路由的请求（404）合并为一个标签值，避免任意路径产生大量时间序列
+UNMATCHED_ROUTE = "unmatched"
+
+class MetricsMiddleware:
+    """按路由模板记录 HTTP 请求延迟，以及每个请求的各阶段耗时和查询条数。
+
+    流式响应的耗时截止到最后一块数据发送完成。WebSocket 连接不在这里统计，按对话轮次在 routers/ws.py 中记录。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+
+    def route_name(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if not self._routes:
+            self._routes = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._routes.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with track_request() as stats:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = self.route_name(scope)
+                stats.observe(route)
+                request_duration.labels(scope["method"], route, status).observe(time.perf_counter() - started)
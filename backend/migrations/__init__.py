@@ -0,0 +1,188 @@
+"""版本化的数据库迁移。
+
+迁移定义在 migrations/versions.py 中，按版本号依次执行，已执行的版本记录在 schema_version 表。
+执行方式：python manage.py migrate。应用启动时只检查版本，不修改表结构。
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from config.logger import logger
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# PostgreSQL advisory lock 的键，防止多个进程同时迁移
+MIGRATION_LOCK_KEY = 72_590_118
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+    # CREATE INDEX CONCURRENTLY 等语句不能在事务中执行
+    transactional: bool = True
+
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, description: str, transactional: bool = True):
+    """注册一个迁移；版本号必须连续递增"""
+    def register(fn: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, description, fn, transactional))
+        return fn
+    return register
+
+def has_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    return any(col["name"] == column_name for col in inspect(conn).get_columns(table_name))
+
+def add_column(conn: Connection, column: Column):
+    """按模型中的列定义为已有的表加列，列已存在时跳过"""
+    table_name = column.table.name
+    if has_column(conn, table_name, column.name):
+        return
+    spec = conn.dialect.ddl_compiler(conn.dialect, None).get_column_specification(column)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {spec}"))
+
+def create_index_concurrently(conn: Connection, name: str, definition: str, unique: bool = False):
+    """PostgreSQL：CREATE INDEX CONCURRENTLY，需在事务外执行；definition 为 ON 之后的部分。
+
+    同名的有效索引已存在时跳过；上次中途失败会留下无效索引，删除后重建。
+    """
+    valid = conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+    ), {"name": name}).scalar()
+    if valid:
+        return
+    if valid is not None:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {definition}"))
+
+def create_index(conn: Connection, index, concurrently: bool = False):
+    """创建索引，同名索引已存在时跳过"""
+    table_name = index.table.name
+    if concurrently and conn.dialect.name == "postgresql":
+        columns = ", ".join(col.name for col in index.columns)
+        create_index_concurrently(conn, index.name, f"{table_name} ({columns})", unique=index.unique)
+        return
+    if any(ix["name"] == index.name for ix in inspect(conn).get_indexes(table_name)):
+        return
+    index.create(conn)
+
+def ensure_primary_key(conn: Connection, table: Table):
+    """旧库中的关联表可能没有主键：删除重复行后按模型补上主键（SQLite 无法加主键，改为唯一索引）"""
+    if inspect(conn).get_pk_constraint(table.name)["constrained_columns"]:
+        return
+    columns = [col.name for col in table.primary_key.columns]
+    column_list = ", ".join(columns)
+    for column in columns:
+        conn.execute(text(f"DELETE FROM {table.name} WHERE {column} IS NULL"))
+    if conn.dialect.name == "postgresql":
+        same = " AND ".join(f"a.{column} = b.{column}" for column in columns)
+        conn.execute(text(f"DELETE FROM {table.name} a USING {table.name} b WHERE a.ctid < b.ctid AND {same}"))
+        name = f"{table.name}_pkey"
+        conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table.name} ({column_list})"))
+        for column in columns:
+            conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column} SET NOT NULL"))
+        conn.execute(text(f"ALTER TABLE {table.name} ADD CONSTRAINT {name} PRIMARY KEY USING INDEX {name}"))
+    else:
+        conn.execute(text(
+            f"DELETE FROM {table.name} WHERE rowid NOT IN "
+            f"(SELECT min(rowid) FROM {table.name} GROUP BY {column_list})"
+        ))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table.name} ON {table.name} ({column_list})"))
+
+def cascade_foreign_key(conn: Connection, column: Column):
+    """PostgreSQL：把列上的外键改为 ON DELETE CASCADE。
+
+    新约束以 NOT VALID 替换旧约束（只短暂加锁），再单独校验已有数据，校验期间不阻塞读写。
+    """
+    table_name = column.table.name
+    target = next(iter(column.foreign_keys)).column
+    existing = [
+        fk for fk in inspect(conn).get_foreign_keys(table_name) if fk["constrained_columns"] == [column.name]
+    ]
+    if any((fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE" for fk in existing):
+        return
+    name = existing[0]["name"] if existing else f"{table_name}_{column.name}_fkey"
+    drop = f"DROP CONSTRAINT {name}, " if existing else ""
+    conn.execute(text(
+        f"ALTER TABLE {table_name} {drop}ADD CONSTRAINT {name} FOREIGN KEY ({column.name}) "
+        f"REFERENCES {target.table.name} ({target.name}) ON DELETE CASCADE NOT VALID"
+    ))
+    conn.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {name}"))
+
+def create_table(conn: Connection, table: Table):
+    table.create(conn, checkfirst=True)
+
+def latest_version() -> int:
+    _load_versions()
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+def _load_versions():
+    # 导入时注册全部迁移
+    from migrations import versions  # noqa: F401
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """执行尚未执行的迁移，返回本次执行的版本号"""
+    _load_versions()
+    applied = []
+    with engine.connect() as conn:
+        is_postgres = conn.dialect.name == "postgresql"
+        if is_postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            with conn.begin():
+                schema_version.create(conn, checkfirst=True)
+            version = current_version(conn)
+            for step in MIGRATIONS:
+                if step.version <= version or (target is not None and step.version > target):
+                    continue
+                logger.info("Applying migration %s: %s", step.version, step.description)
+                if step.transactional:
+                    with conn.begin():
+                        step.upgrade(conn)
+                        _record(conn, step)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as autocommit:
+                        step.upgrade(autocommit)
+                    with conn.begin():
+                        _record(conn, step)
+                applied.append(step.version)
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    return applied
+
+def _record(conn: Connection, step: Migration):
+    conn.execute(schema_version.insert().values(
+        version=step.version,
+        description=step.description,
+        applied_at=datetime.utcnow()
+    ))
+
+class SchemaOutdatedError(RuntimeError):
+    pass
+
+def check_schema(engine: Engine) -> int:
+    """确认数据库已迁移到当前代码需要的版本；只执行一次查询"""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    latest = latest_version()
+    if version < latest:
+        raise SchemaOutdatedError(
+            f"数据库结构版本为 {version}，当前代码需要 {latest}，请先运行 python manage.py migrate"
+        )
+    if version > latest:
+        logger.warning("数据库结构版本 %s 高于当前代码的版本 %s", version, latest)
+    return version
@@ -0,0 +1,42 @@
+import os
+
+from sqlalchemy.orm import Session
+
+from config.logger import logger
+from models import Role, User
+from passwords import get_password_hash
+
+# 初始管理员账号，首次部署后应尽快修改密码
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+
+def seed_defaults(db: Session):
+    """创建默认角色和管理员，已存在时跳过"""
+    # 检查admin角色是否存在
+    admin_role = db.query(Role).filter(Role.name == "admin").first()
+    if not admin_role:
+        admin_role = Role(name="admin", description="Administrator role")
+        db.add(admin_role)
+        logger.info("Created admin role")
+    
+    # 检查user角色是否存在
+    user_role = db.query(Role).filter(Role.name == "user").first()
+    if not user_role:
+        user_role = Role(name="user", description="Regular user role")
+        db.add(user_role)
+        logger.info("Created user role")
+    
+    db.commit()
+    
+    # 检查admin用户是否存在
+    admin_user = db.query(User).filter(User.username == ADMIN_USERNAME).first()
+    if not admin_user:
+        admin_user = User(
+            username=ADMIN_USERNAME,
+            hashed_password=get_password_hash(ADMIN_PASSWORD),
+            is_admin=True
+        )
+        admin_user.roles.append(admin_role)
+        db.add(admin_user)
+        db.commit()
+        logger.info("Created admin user")
@@ -0,0 +1,137 @@
+"""迁移定义。
+
+表和列的定义取自当前模型：新库在版本 1 直接建出完整的表，之后的迁移发现列或索引已存在时跳过；
+由旧版本 create_all 建出的库则由之后的迁移逐步补齐。
+"""
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.engine import Connection
+
+from migrations import (
+    add_column, cascade_foreign_key, create_index, create_index_concurrently, create_table, ensure_primary_key,
+    migration
+)
+from models import Conversation, Message, Permission, Role, SummaryJob, User, role_permissions, user_roles
+from services.search import SEARCH_TS_CONFIG
+
+def _index(table, name: str):
+    return next(ix for ix in table.indexes if ix.name == name)
+
+@migration(1, "create users, roles, permissions, conversations and messages")
+def create_base_tables(conn: Connection):
+    for table in (
+        User.__table__, Role.__table__, Permission.__table__, user_roles, role_permissions,
+        Conversation.__table__, Message.__table__,
+    ):
+        create_table(conn, table)
+
+@migration(2, "rolling conversation summary")
+def add_conversation_summary(conn: Connection):
+    add_column(conn, Conversation.__table__.c.summary)
+    add_column(conn, Conversation.__table__.c.summary_message_id)
+
+@migration(3, "index messages by conversation, created_at, id", transactional=False)
+def add_message_pagination_index(conn: Connection):
+    # 不在事务中执行：PostgreSQL 上并发建索引，已有大量消息时不阻塞消息写入
+    create_index(conn, _index(Message.__table__, "ix_messages_conversation_created_id"), concurrently=True)
+
+@migration(4, "per-conversation and per-user llm provider")
+def add_llm_provider(conn: Connection):
+    add_column(conn, Conversation.__table__.c.llm_provider)
+    add_column(conn, User.__table__.c.llm_provider)
+
+@migration(5, "summary job queue")
+def create_summary_jobs(conn: Connection):
+    create_table(conn, SummaryJob.__table__)
+
+def create_search_expression_indexes(conn: Connection):
+    """PostgreSQL：消息内容和标题的 to_tsvector 表达式 GIN 索引，并发创建，不改写表也不阻塞写入"""
+    create_index_concurrently(
+        conn, "ix_messages_content_search", f"messages USING GIN (to_tsvector('{SEARCH_TS_CONFIG}', content))"
+    )
+    create_index_concurrently(
+        conn, "ix_conversations_title_search", f"conversations USING GIN (to_tsvector('{SEARCH_TS_CONFIG}', title))"
+    )
+
+@migration(6, "full-text search over messages and conversation titles", transactional=False)
+def add_search_index(conn: Connection):
+    # 检索结构不在模型中，按数据库分别创建；查询见 services/search.py
+    if conn.dialect.name == "postgresql":
+        create_search_expression_indexes(conn)
+        return
+
+    # SQLite：外部内容 FTS5 表，触发器在同一事务中同步插入、删除和修改
+    for table, column in (("messages", "content"), ("conversations", "title")):
+        fts = f"{table}_fts"
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column}, content='{table}', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END"
+        ))
+        # 为已有数据建立索引
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+@migration(7, "denormalized conversation stats")
+def add_conversation_stats(conn: Connection):
+    # 已有对话的统计由 python manage.py backfill-stats 填充
+    for column in ("message_count", "last_message_at", "last_message_preview", "token_total"):
+        add_column(conn, Conversation.__table__.c[column])
+
+@migration(8, "indexes for conversation listings and association tables, cascade deletes", transactional=False)
+def add_access_path_indexes(conn: Connection):
+    # 不在事务中执行：PostgreSQL 上并发建索引，不阻塞写入
+    for table, name in (
+        (Conversation.__table__, "ix_conversations_user_updated_id"),
+        (Conversation.__table__, "ix_conversations_updated_id"),
+        (user_roles, "ix_user_roles_role_id"),
+        (role_permissions, "ix_role_permissions_permission_id"),
+    ):
+        create_index(conn, _index(table, name), concurrently=True)
+    for table in (user_roles, role_permissions):
+        ensure_primary_key(conn, table)
+    # SQLite 无法修改已有表的外键，旧库保持原约束（新库在版本 1 按模型建出）
+    if conn.dialect.name == "postgresql":
+        for column in (
+            Message.__table__.c.conversation_id,
+            Conversation.__table__.c.user_id,
+            SummaryJob.__table__.c.conversation_id,
+            SummaryJob.__table__.c.user_id,
+            user_roles.c.user_id,
+            user_roles.c.role_id,
+            role_permissions.c.role_id,
+            role_permissions.c.permission_id,
+        ):
+            cascade_foreign_key(conn, column)
+
+@migration(9, "conversations.updated_at not null", transactional=False)
+def require_conversation_updated_at(conn: Connection):
+    # 旧模型的 updated_at 只在修改时赋值，早期创建的对话为空，列表分页会跳过这些行
+    # 时间以参数传入，由 SQLAlchemy 按列类型格式化（SQLite 中与其他行的字符串格式一致，比较才正确）
+    conn.execute(
+        text("UPDATE conversations SET updated_at = COALESCE(created_at, :now) WHERE updated_at IS NULL")
+        .bindparams(bindparam("now", datetime.utcnow(), type_=DateTime()))
+    )
+    # SQLite 不能修改已有列的约束，补齐数据即可（模型保证新行有值）
+    if conn.dialect.name != "postgresql":
+        return
+    # 先以 NOT VALID 的 CHECK 约束校验（不阻塞读写），SET NOT NULL 时即可跳过全表扫描
+    conn.execute(text(
+        "ALTER TABLE conversations ADD CONSTRAINT conversations_updated_at_not_null "
+        "CHECK (updated_at IS NOT NULL) NOT VALID"
+    ))
+    conn.execute(text("ALTER TABLE conversations VALIDATE CONSTRAINT conversations_updated_at_not_null"))
+    conn.execute(text("ALTER TABLE conversations ALTER COLUMN updated_at SET NOT NULL"))
+    conn.execute(text("ALTER TABLE conversations DROP CONSTRAINT conversations_updated_at_not_null"))
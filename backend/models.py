@@ -1,88 +0,0 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table, DateTime
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
-from database import Base
-
-# 用户-角色关联表
-user_roles = Table(
-    'user_roles',
-    Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
-    Column('role_id', Integer, ForeignKey('roles.id'), primary_key=True)
-)
-
-# 角色-权限关联表
-role_permissions = Table(
-    'role_permissions',
-    Base.metadata,
-    Column('role_id', Integer, ForeignKey('roles.id')),
-    Column('permission_id', Integer, ForeignKey('permissions.id'))
-)
-
-class User(Base):
-    __tablename__ = "users"
-
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    email = Column(String, unique=True, index=True)
-    hashed_password = Column(String)
-    is_active = Column(Boolean, default=True)
-    is_admin = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
-    # 用户-角色多对多关系
-    roles = relationship("Role", secondary=user_roles, back_populates="users")
-    
-    # 与对话的一对多关系
-    conversations = relationship("Conversation", back_populates="user")
-
-class Role(Base):
-    __tablename__ = "roles"
-
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
-    description = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
-    # 角色-用户多对多关系
-    users = relationship("User", secondary=user_roles, back_populates="roles")
-    # 角色-权限多对多关系
-    permissions = relationship("Permission", secondary=role_permissions, back_populates="roles")
-
-class Permission(Base):
-    __tablename__ = "permissions"
-
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
-    description = Column(String)
-    
-    # 权限-角色多对多关系
-    roles = relationship("Role", secondary=role_permissions, back_populates="permissions")
-
-class Conversation(Base):
-    __tablename__ = "conversations"
-
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
-    # 与用户的多对一关系
-    user = relationship("User", back_populates="conversations")
-    # 与消息的一对多关系
-    messages = relationship("Message", back_populates="conversation")
-
-class Message(Base):
-    __tablename__ = "messages"
-
-    id = Column(Integer, primary_key=True, index=True)
-    content = Column(String)
-    role = Column(String)  # 'user' or 'assistant'
-    conversation_id = Column(Integer, ForeignKey("conversations.id"))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    
-    # 与对话的多对一关系
-    conversation = relationship("Conversation", back_populates="messages") 
\ No newline at end of file
@@ -2,8 +2,9 @@ from .user import User
 from .role import Role
 from .permission import Permission
 from .conversation import Conversation, Message
+from .summary_job import SummaryJob
 from .user_role import user_roles
 from .role_permission import role_permissions
 from database import Base
 
-__all__ = ["User", "Role", "Permission", "Conversation", "Message", "user_roles", "role_permissions", "Base"] 
\ No newline at end of file
+__all__ = ["User", "Role", "Permission", "Conversation", "Message", "SummaryJob", "user_roles", "role_permissions", "Base"] 
\ No newline at end of file
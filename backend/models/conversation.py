@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -8,20 +8,46 @@ class Conversation(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 列表按 (updated_at, id) 做 keyset 分页，不允许为空
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 滚动摘要：summary_message_id 及之前的消息已折叠进 summary
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+    # 对话使用的模型提供方，为空时使用用户或全局默认值
+    llm_provider = Column(String, nullable=True)
+    # 冗余统计，写入消息时在同一事务中更新（services/conversation_stats.py），列表无需扫描 messages
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String, nullable=True)
+    token_total = Column(Integer, nullable=False, default=0, server_default="0")
 
-    messages = relationship("Message", back_populates="conversation")
+    # 删除对话时由数据库级联删除消息，不逐条加载
+    messages = relationship(
+        "Message", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True
+    )
     user = relationship("User", back_populates="conversations")
 
+    __table_args__ = (
+        # 用户的对话列表：WHERE user_id = ? ORDER BY updated_at DESC, id DESC（keyset 分页）
+        Index("ix_conversations_user_updated_id", "user_id", "updated_at", "id"),
+        # 管理员查看全部对话，排序同上
+        Index("ix_conversations_updated_id", "updated_at", "id"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"))
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"))
     content = Column(String, nullable=False)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    conversation = relationship("Conversation", back_populates="messages") 
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+    __table_args__ = (
+        # 按对话分页读取消息：WHERE conversation_id = ? ORDER BY created_at, id
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),
+    ) 
\ No newline at end of file
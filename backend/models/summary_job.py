@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index
+from datetime import datetime
+from database import Base
+
+class SummaryJob(Base):
+    """对话标题生成任务，持久化以便进程重启后继续执行"""
+    __tablename__ = "summary_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / running / done / failed
+    # 生成标题时使用的消息条数，条数不变时无需重新生成
+    message_count = Column(Integer, nullable=False, default=0)
+    # 为 False 时跳过模型回复缓存
+    use_cache = Column(Boolean, nullable=False, default=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    title = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 查找对话最近的任务、按状态恢复未完成的任务
+        Index("ix_summary_jobs_conversation_id", "conversation_id", "id"),
+        Index("ix_summary_jobs_status", "status"),
+    )
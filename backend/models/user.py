@@ -11,6 +11,9 @@ class User(Base):
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
+    llm_provider = Column(String, nullable=True)
 
     roles = relationship("Role", secondary="user_roles", back_populates="users")
-    conversations = relationship("Conversation", back_populates="user") 
\ No newline at end of file
+    conversations = relationship(
+        "Conversation", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
+    ) 
\ No newline at end of file
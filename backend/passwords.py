@@ -0,0 +1,128 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from metrics import Counter, Gauge, Histogram
+
+# bcrypt 成本参数；调整后旧哈希会在用户下次登录时自动重新计算
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# 计算哈希的进程数，即同时进行的 bcrypt 计算上限
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# 排队等待的任务上限，超出后登录请求直接返回 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+password_hash_pending = Gauge("password_hash_pending", "Password hashing jobs running or queued")
+password_hash_queued = Gauge("password_hash_queued", "Password hashing jobs waiting for a free worker")
+password_hash_rejected = Counter("password_hash_rejected_total", "Password hashing jobs rejected because the queue was full")
+password_hash_seconds = Histogram("password_hash_seconds", "Time from submitting a hashing job to its completion")
+
+class PasswordHashBusy(Exception):
+    """哈希队列已满"""
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def verify_and_update(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """校验密码；成本参数变化时同时返回新哈希"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def hash_many(passwords: List[str]) -> List[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+class HashingPool:
+    """有界的密码哈希进程池。
+
+    最多 workers 个任务同时计算，另有 max_queue 个任务排队。队列满时同步调用方（运行在线程池中的
+    路由、批量导入）默认阻塞等待，登录和异步调用方则抛出 PasswordHashBusy。
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self._executor = None
+        self._pending = 0
+        self._cond = threading.Condition()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # 按需创建，每个 worker 进程各自持有一个
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _update_gauges(self):
+        password_hash_pending.set(self._pending)
+        password_hash_queued.set(max(self._pending - self.workers, 0))
+
+    def _release(self, started: float):
+        password_hash_seconds.observe(time.perf_counter() - started)
+        with self._cond:
+            self._pending -= 1
+            self._update_gauges()
+            self._cond.notify()
+
+    def submit(self, fn, *args, block: bool = True) -> Future:
+        with self._cond:
+            if self._pending >= self.capacity:
+                if not block:
+                    password_hash_rejected.inc()
+                    raise PasswordHashBusy()
+                while self._pending >= self.capacity:
+                    self._cond.wait()
+            self._pending += 1
+            self._update_gauges()
+            executor = self._get_executor()
+        started = time.perf_counter()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._release(started)
+            raise
+        future.add_done_callback(lambda _: self._release(started))
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args, block=False))
+
+    def shutdown(self):
+        with self._cond:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+hashing_pool = HashingPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+def verify_password_pooled(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """供同步路由使用，在进程池中校验密码；返回 (是否正确, 需要更新时的新哈希)。
+
+    队列满时抛出 PasswordHashBusy 而不是等待，登录高峰时不占满路由线程池。
+    """
+    return hashing_pool.submit(verify_and_update, plain_password, hashed_password, block=False).result()
+
+async def hash_password_async(password) -> str:
+    return await hashing_pool.run(get_password_hash, password)
+
+def hash_password(password) -> str:
+    """供同步路由使用，在进程池中计算哈希"""
+    return hashing_pool.submit(get_password_hash, password).result()
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """将一批密码分块并行计算哈希，顺序与输入一致"""
+    if not passwords:
+        return []
+    chunk_size = -(-len(passwords) // PASSWORD_HASH_WORKERS)
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    futures = [hashing_pool.submit(hash_many, chunk) for chunk in chunks]
+    return [hashed for future in futures for hashed in future.result()]
+
+def shutdown():
+    hashing_pool.shutdown()
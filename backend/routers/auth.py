@@ -3,24 +3,16 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import jwt
-from passlib.context import CryptContext
 from config.logger import logger
 
 from database import get_db
 from models import User
 from schemas import User as UserSchema
 from dependencies import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from passwords import verify_password, get_password_hash, verify_password_pooled, PasswordHashBusy
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -32,35 +24,52 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    logger.info(f"Login attempt for user: {form_data.username}")
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    logger.info("Login attempt for user: %s", form_data.username)
     
     user = db.query(User).filter(User.username == form_data.username).first()
     if not user:
-        logger.warning(f"Login failed: User not found - {form_data.username}")
+        logger.warning("Login failed: User not found - %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Login failed: Invalid password for user - {form_data.username}")
+    # 同步路由运行在线程池中，查询、bcrypt 校验（在进程池中进行）和提交都不阻塞事件循环
+    try:
+        valid, new_hash = verify_password_pooled(form_data.password, user.hashed_password)
+    except PasswordHashBusy:
+        logger.warning("Login rejected, password hashing queue is full - %s", form_data.username)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    
+    if not valid:
+        logger.warning("Login failed: Invalid password for user - %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # 成本参数变化后透明地升级哈希
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+        logger.info("Password hash upgraded for user: %s", form_data.username)
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
     
-    logger.info(f"Login successful for user: {form_data.username}")
+    logger.info("Login successful for user: %s", form_data.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserSchema)
 async def read_users_me(current_user: User = Depends(get_current_user)):
-    logger.info(f"User profile accessed: {current_user.username}")
+    logger.info("User profile accessed: %s", current_user.username)
     return current_user 
\ No newline at end of file
@@ -1,49 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
+from typing import List, AsyncIterator, Optional
+from anyio import CancelScope
+from database import AsyncSessionLocal, get_db, get_async_db
 from models import Message, Conversation, User
 from schemas import MessageCreate, Message as MessageSchema, ConversationCreate, ConversationResponse
 from dependencies import get_current_user
-from openai import OpenAI
-import os
+from services.llm import LLMProvider, UnknownProviderError, available_providers, validate_provider
+from services.llm_limiter import LLMUnavailableError
+from services.summary_jobs import ACTIVE_STATUSES, enqueue_summary, get_latest_job
+from services.turns import get_history_entries, get_user_conversation, prepare_turn, save_message, serialize_message
 from config.logger import logger
-import openai
+from instrumentation import measure_stage
+import json
 from datetime import datetime
 
 router = APIRouter()
 
-# 配置OpenAI客户端
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    logger.warning("OpenAI API密钥未设置，将使用模拟响应")
-    client = None
-else:
-    try:
-        client = OpenAI(api_key=api_key)
-        logger.info("OpenAI客户端初始化成功")
-    except Exception as e:
-        logger.error(f"OpenAI客户端初始化失败: {str(e)}")
-        client = None
-
-# 配置 OpenAI API
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-def get_conversation_history(db: Session, conversation_id: int) -> List[dict]:
+async def get_conversation_history(db: AsyncSession, conversation_id: int) -> List[dict]:
     """获取对话的历史消息"""
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.created_at).all()
+    messages = await get_history_entries(db, conversation_id)
     
     # 将消息转换为OpenAI API所需的格式
     return [
-        {"role": msg.role, "content": msg.content}
+        {"role": msg["role"], "content": msg["content"]}
         for msg in messages
     ]
 
-def get_mock_response(message: str) -> str:
-    """当OpenAI API不可用时返回模拟响应"""
-    return f"模拟响应: {message}"
+def wants_stream(request: Request, stream: bool) -> bool:
+    """是否以流式方式返回回复（查询参数 stream=true 或 Accept: text/event-stream）"""
+    return stream or "text/event-stream" in request.headers.get("accept", "")
+
+def wants_cache(request: Request, cache: bool) -> bool:
+    """是否允许使用回复缓存（查询参数 cache=false 或 Cache-Control: no-cache / no-store 时跳过）"""
+    cache_control = request.headers.get("cache-control", "")
+    return cache and "no-cache" not in cache_control and "no-store" not in cache_control
+
+def format_sse(event: str, data: dict) -> str:
+    """将事件编码为一条 SSE 消息"""
+    with measure_stage("serialize"):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_assistant_reply(
+    user_id: int,
+    conversation_id: int,
+    provider: LLMProvider,
+    openai_messages: List[dict]
+) -> AsyncIterator[str]:
+    """逐个转发模型返回的 token，结束后使用新的会话一次性保存完整的助手消息。
+
+    客户端断开连接时 Starlette 会取消该生成器，finally 中关闭上游流，
+    从而终止对模型的请求；此时不保存不完整的回复。
+    """
+    parts = []
+    upstream = provider.stream(openai_messages)
+    try:
+        async for token in upstream:
+            parts.append(token)
+            yield format_sse("token", {"content": token})
+    except Exception as e:
+        logger.error("流式处理消息时发生错误: %s", e)
+        yield format_sse("error", {"detail": str(e)})
+        return
+    finally:
+        with CancelScope(shield=True):
+            await upstream.aclose()
+
+    async with AsyncSessionLocal() as db:
+        ai_message = await save_message(db, user_id, conversation_id, "assistant", "".join(parts))
+    logger.info("助手消息已保存: %s", ai_message.id)
+    yield format_sse("done", serialize_message(ai_message))
+
+@router.get("/providers")
+def get_providers(current_user: User = Depends(get_current_user)):
+    """可选的模型提供方"""
+    return {"providers": available_providers()}
 
 @router.post("/conversations", response_model=ConversationResponse)
 def create_conversation(
@@ -51,9 +85,14 @@ def create_conversation(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
+    try:
+        validate_provider(conversation.llm_provider)
+    except UnknownProviderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db_conversation = Conversation(
         title=conversation.title,
-        user_id=current_user.id
+        user_id=current_user.id,
+        llm_provider=conversation.llm_provider
     )
     db.add(db_conversation)
     db.commit()
@@ -64,75 +103,68 @@ def create_conversation(
 async def create_message(
     conversation_id: int,
     message: MessageCreate,
-    db: Session = Depends(get_db),
+    request: Request,
+    stream: bool = False,
+    cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"用户 {current_user.username} 尝试在对话 {conversation_id} 中发送消息")
+    logger.info("用户 %s 尝试在对话 %s 中发送消息", current_user.username, conversation_id)
     
     # 检查对话是否存在且属于当前用户
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    conversation = await get_user_conversation(db, conversation_id, current_user.id)
     
     if not conversation:
-        logger.warning(f"对话 {conversation_id} 不存在或不属于用户 {current_user.username}")
+        logger.warning("对话 %s 不存在或不属于用户 %s", conversation_id, current_user.username)
         raise HTTPException(status_code=404, detail="对话不存在")
     
     try:
-        # 保存用户消息
-        user_message = Message(
-            content=message.content,
-            role="user",
-            conversation_id=conversation_id
+        # 保存用户消息，构建本轮的模型请求
+        user_message, provider, openai_messages = await prepare_turn(
+            db, conversation, current_user, message.content, use_cache=wants_cache(request, cache)
         )
-        db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
-        logger.info(f"用户消息已保存: {user_message.id}")
         
-        # 获取对话历史
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
-        logger.info(f"获取到 {len(messages)} 条历史消息")
+        # 流式模式：边生成边转发 token
+        if wants_stream(request, stream):
+            return StreamingResponse(
+                stream_assistant_reply(current_user.id, conversation_id, provider, openai_messages),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
-        # 构建 OpenAI 请求
-        openai_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
-        ]
+        # 调用模型
+        reply = await provider.complete(openai_messages)
         
-        # 调用 OpenAI API
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=openai_messages,
-            temperature=0.7
-        )
-        
-        # 保存 AI 回复
-        ai_message = Message(
-            content=response.choices[0].message.content,
-            role="assistant",
-            conversation_id=conversation_id
-        )
-        db.add(ai_message)
-        db.commit()
-        db.refresh(ai_message)
-        logger.info(f"助手消息已保存: {ai_message.id}")
+        # 保存 AI 回复：请求会话在调用模型前已结束事务，这里使用新的会话
+        async with AsyncSessionLocal() as reply_db:
+            ai_message = await save_message(reply_db, current_user.id, conversation_id, "assistant", reply)
+        logger.info("助手消息已保存: %s", ai_message.id)
         
         return ai_message
+    except LLMUnavailableError as e:
+        logger.warning("模型服务繁忙: %s", e)
+        raise HTTPException(status_code=503, detail="模型服务繁忙，请稍后重试", headers={"Retry-After": "5"})
     except Exception as e:
-        logger.error(f"处理消息时发生错误: {str(e)}")
+        logger.error("处理消息时发生错误: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/messages/{conversation_id}", response_model=List[MessageSchema])
 def get_messages(
     conversation_id: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    logger.info(f"用户 {current_user.username} 尝试获取对话 {conversation_id} 的消息")
+    """获取对话消息，按时间升序返回。
+
+    - after_id：只返回该消息之后的新消息（客户端增量同步）
+    - before_id：只返回该消息之前的消息（向上翻页）
+    - limit：最多返回的条数；与 before_id 一起或单独使用时返回最近的 limit 条
+    不带参数时返回全部消息。
+    """
+    logger.info("用户 %s 尝试获取对话 %s 的消息", current_user.username, conversation_id)
     
     # 检查对话是否存在且属于当前用户
     conversation = db.query(Conversation).filter(
@@ -141,73 +173,103 @@ def get_messages(
     ).first()
     
     if not conversation:
-        logger.warning(f"对话 {conversation_id} 不存在或不属于用户 {current_user.username}")
+        logger.warning("对话 %s 不存在或不属于用户 %s", conversation_id, current_user.username)
         raise HTTPException(status_code=404, detail="对话不存在")
     
-    try:
-        # 获取对话的所有消息
-        messages = db.query(Message).filter(
+    # 以 (created_at, id) 作为游标，命中 (conversation_id, created_at, id) 索引
+    position = tuple_(Message.created_at, Message.id)
+    anchors = {}
+    for name, anchor_id in (("after_id", after_id), ("before_id", before_id)):
+        if anchor_id is None:
+            continue
+        anchor = db.query(Message.created_at, Message.id).filter(
+            Message.id == anchor_id,
             Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
+        ).first()
+        if not anchor:
+            # 游标消息已被删除（例如整段对话被重写），客户端应重新完整拉取
+            raise HTTPException(status_code=404, detail=f"消息 {anchor_id} 不存在")
+        anchors[name] = tuple_(anchor.created_at, anchor.id)
+    
+    try:
+        query = db.query(Message).filter(Message.conversation_id == conversation_id)
+        if "after_id" in anchors:
+            query = query.filter(position > anchors["after_id"])
+        if "before_id" in anchors:
+            query = query.filter(position < anchors["before_id"])
+        
+        if limit is not None and after_id is None:
+            # 取最近的 limit 条，再恢复为升序
+            messages = query.order_by(
+                Message.created_at.desc(), Message.id.desc()
+            ).limit(limit).all()
+            messages.reverse()
+        else:
+            query = query.order_by(Message.created_at, Message.id)
+            if limit is not None:
+                query = query.limit(limit)
+            messages = query.all()
         
-        logger.info(f"成功获取对话 {conversation_id} 的 {len(messages)} 条消息")
+        logger.info("成功获取对话 %s 的 %s 条消息", conversation_id, len(messages))
         return messages
     except Exception as e:
-        logger.error(f"获取消息时发生错误: {str(e)}")
+        logger.error("获取消息时发生错误: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+def summary_job_response(conversation: Conversation, job) -> dict:
+    return {
+        "title": conversation.title,
+        "job_id": job.id,
+        "status": job.status,
+    }
+
 @router.post("/{conversation_id}/summarize")
 async def summarize_conversation(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    cache: bool = True,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"用户 {current_user.username} 尝试总结对话 {conversation_id}")
+    """提交标题生成任务，立即返回当前标题和任务状态；任务进行中时返回 202"""
+    logger.info("用户 %s 尝试总结对话 %s", current_user.username, conversation_id)
     
     # 检查对话是否存在且属于当前用户
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    conversation = await get_user_conversation(db, conversation_id, current_user.id)
     
     if not conversation:
-        logger.warning(f"对话 {conversation_id} 不存在或不属于用户 {current_user.username}")
+        logger.warning("对话 %s 不存在或不属于用户 %s", conversation_id, current_user.username)
         raise HTTPException(status_code=404, detail="对话不存在")
 
     # 获取对话历史
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.created_at).all()
+    messages = await get_history_entries(db, conversation_id)
 
     if len(messages) < 3:
         logger.info("对话长度小于3条，无法生成摘要")
         return {"title": conversation.title}
 
-    # 构建总结提示
-    conversation_text = "\n".join([
-        f"{msg.role}: {msg.content}"
-        for msg in messages[:5]  # 只使用前5条消息来生成标题
-    ])
-
     try:
-        # 调用 OpenAI API 生成标题
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "你是一个专业的对话总结助手。请根据以下对话内容，生成一个简洁的标题（不超过10个字）。标题应该概括对话的主要主题。"},
-                {"role": "user", "content": conversation_text}
-            ],
-            temperature=0.3
+        # 相同对话的重复请求合并到已有任务
+        job = await enqueue_summary(
+            db, conversation_id, current_user.id, len(messages), use_cache=wants_cache(request, cache)
         )
-
-        new_title = response.choices[0].message.content.strip()
-        
-        # 更新对话标题
-        conversation.title = new_title
-        db.commit()
-
-        logger.info(f"对话摘要生成成功，新标题: {new_title}")
-        return {"title": new_title}
+        status_code = 202 if job.status in ACTIVE_STATUSES else 200
+        return JSONResponse(status_code=status_code, content=summary_job_response(conversation, job))
     except Exception as e:
-        logger.error(f"生成对话摘要时发生错误: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        logger.error("提交对话摘要任务时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{conversation_id}/summarize")
+async def get_summary_status(
+    conversation_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """查询对话最近一次标题生成任务的状态，供客户端轮询"""
+    conversation = await get_user_conversation(db, conversation_id, current_user.id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="对话不存在")
+    job = await get_latest_job(db, conversation_id)
+    if job is None:
+        return {"title": conversation.title, "job_id": None, "status": None}
+    return summary_job_response(conversation, job)
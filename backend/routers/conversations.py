@@ -1,29 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException
+from anyio import from_thread
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
+import base64
+import json
 from models import Conversation, Message, User
 from database import get_db
 from dependencies import get_current_user
-from schemas import Conversation as ConversationSchema, ConversationCreate, MessageCreate
+from schemas import Conversation as ConversationSchema, ConversationCreate, ConversationPage, MessageCreate, MessageSync, SearchPage
 from config.logger import logger
+from services.conversation_stats import stats_update
+from services.history_cache import history_cache, to_cache_entry
+from services.llm import UnknownProviderError, validate_provider
+from services.search import search
 
 router = APIRouter()
 
+def encode_cursor(updated_at: datetime, conversation_id: int) -> str:
+    raw = json.dumps([updated_at.isoformat(), conversation_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def list_conversation_summaries(
+    db: Session,
+    user_id: Optional[int],
+    cursor: Optional[str],
+    limit: int
+) -> dict:
+    """Keyset-paginated conversation summaries ordered by (updated_at, id) desc.
+
+    Message count, last message and token total are maintained on the
+    conversation row, so the page never reads the messages table.
+    """
+    query = db.query(
+        Conversation.id,
+        Conversation.title,
+        Conversation.user_id,
+        Conversation.updated_at,
+        Conversation.last_message_at,
+        Conversation.last_message_preview,
+        Conversation.message_count,
+        Conversation.token_total,
+    )
+    if user_id is not None:
+        query = query.filter(Conversation.user_id == user_id)
+    if cursor:
+        updated_at, conversation_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(Conversation.updated_at, Conversation.id) < tuple_(updated_at, conversation_id)
+        )
+    rows = query.order_by(
+        Conversation.updated_at.desc(), Conversation.id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+    return {"items": [dict(row._mapping) for row in rows], "next_cursor": next_cursor}
+
 @router.post("/", response_model=ConversationSchema)
 def create_conversation(
     conversation: ConversationCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"Creating new conversation for user: {current_user.username}")
+    logger.info("Creating new conversation for user: %s", current_user.username)
+    try:
+        validate_provider(conversation.llm_provider)
+    except UnknownProviderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db_conversation = Conversation(
         title=conversation.title,
-        user_id=current_user.id
+        user_id=current_user.id,
+        llm_provider=conversation.llm_provider
     )
     db.add(db_conversation)
     db.commit()
     db.refresh(db_conversation)
-    logger.info(f"Conversation created successfully: {db_conversation.id}")
+    logger.info("Conversation created successfully: %s", db_conversation.id)
     return db_conversation
 
 @router.get("/", response_model=List[ConversationSchema])
@@ -31,28 +94,125 @@ def get_conversations(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"Fetching conversations for user: {current_user.username}")
+    logger.info("Fetching conversations for user: %s", current_user.username)
     conversations = db.query(Conversation).filter(
         Conversation.user_id == current_user.id
     ).all()
     return conversations
 
+@router.get("/summaries", response_model=ConversationPage)
+def get_conversation_summaries(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    logger.info("Fetching conversation summaries for user: %s", current_user.username)
+    return list_conversation_summaries(db, current_user.id, cursor, limit)
+
+@router.get("/search", response_model=SearchPage)
+def search_conversations(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Full-text search over the current user's messages and conversation titles.
+
+    Results are ranked by relevance; snippets are HTML-escaped with matches in <mark>.
+    """
+    logger.info("Searching conversations for user: %s", current_user.username)
+    # Fetch one extra row to know whether another page exists
+    items = search(db, current_user.id, q, limit + 1, offset)
+    next_offset = offset + limit if len(items) > limit else None
+    return {"query": q, "items": items[:limit], "next_offset": next_offset}
+
 @router.get("/{conversation_id}", response_model=ConversationSchema)
 def get_conversation(
     conversation_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"Fetching conversation {conversation_id} for user: {current_user.username}")
+    logger.info("Fetching conversation %s for user: %s", conversation_id, current_user.username)
+    conversation = db.query(Conversation).filter(
+        Conversation.id == conversation_id,
+        Conversation.user_id == current_user.id
+    ).first()
+    if not conversation:
+        logger.warning("Conversation %s not found for user: %s", conversation_id, current_user.username)
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+def get_owned_conversation(db: Session, conversation_id: int, current_user: User) -> Conversation:
     conversation = db.query(Conversation).filter(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
     ).first()
     if not conversation:
-        logger.warning(f"Conversation {conversation_id} not found for user: {current_user.username}")
+        logger.warning("Conversation %s not found for user: %s", conversation_id, current_user.username)
         raise HTTPException(status_code=404, detail="Conversation not found")
     return conversation
 
+def sync_messages(
+    db: Session,
+    conversation: Conversation,
+    existing: List[Message],
+    incoming: List[MessageCreate]
+) -> dict:
+    """Make the stored tail `existing` match `incoming` with minimal writes.
+
+    The common (role, content) prefix is kept as is; only the diverging
+    stored messages are deleted and the remaining incoming ones inserted
+    in one batch, together with the conversation stats in one transaction.
+    """
+    common = 0
+    for old, new in zip(existing, incoming):
+        if old.role != new.role or old.content != new.content:
+            break
+        common += 1
+    stale = existing[common:]
+    fresh = [
+        Message(conversation_id=conversation.id, content=msg.content, role=msg.role)
+        for msg in incoming[common:]
+    ]
+
+    if stale:
+        stale_ids = [msg.id for msg in stale]
+        db.query(Message).filter(Message.id.in_(stale_ids)).delete(synchronize_session=False)
+        for msg in stale:
+            db.expunge(msg)
+        # The rolling summary may cover messages that no longer exist
+        if conversation.summary_message_id is not None and min(stale_ids) <= conversation.summary_message_id:
+            conversation.summary = None
+            conversation.summary_message_id = None
+
+    db.add_all(fresh)
+    db.flush()
+    if stale or fresh:
+        db.execute(stats_update(conversation.id, fresh, stale))
+    entries = [to_cache_entry(msg) for msg in fresh]
+    db.commit()
+
+    # Sync routes run in a worker thread; cache calls go through the event loop
+    if stale:
+        from_thread.run(history_cache.invalidate, conversation.id)
+    elif entries:
+        from_thread.run(history_cache.append, conversation.id, entries)
+
+    if entries:
+        last_message_id = entries[-1]["id"]
+    elif common:
+        last_message_id = existing[common - 1].id
+    else:
+        last_message_id = None
+    return {
+        "status": "success",
+        "inserted": len(entries),
+        "deleted": len(stale),
+        "last_message_id": last_message_id,
+    }
+
 @router.post("/{conversation_id}/messages")
 def update_messages(
     conversation_id: int,
@@ -60,32 +220,54 @@ def update_messages(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    logger.info(f"Updating messages for conversation {conversation_id} by user: {current_user.username}")
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
-    if not conversation:
-        logger.warning(f"Conversation {conversation_id} not found for user: {current_user.username}")
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    logger.info("Updating messages for conversation %s by user: %s", conversation_id, current_user.username)
+    conversation = get_owned_conversation(db, conversation_id, current_user)
 
-    # Delete old messages
-    db.query(Message).filter(
+    existing = db.query(Message).filter(
         Message.conversation_id == conversation_id
-    ).delete()
-
-    # Add new messages
-    for msg in messages:
-        db_message = Message(
-            conversation_id=conversation_id,
-            content=msg.content,
-            role=msg.role
+    ).order_by(Message.created_at, Message.id).all()
+    result = sync_messages(db, conversation, existing, messages)
+
+    logger.info(
+        "Messages updated successfully for conversation %s: %s inserted, %s deleted",
+        conversation_id, result["inserted"], result["deleted"]
+    )
+    return result
+
+@router.post("/{conversation_id}/messages/sync")
+def sync_conversation_messages(
+    conversation_id: int,
+    payload: MessageSync,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Sync only the messages after the client's last known message.
+
+    `messages` is the client's full list after `base_message_id` (or the
+    whole conversation when it is null). Only that tail is read and diffed.
+    """
+    conversation = get_owned_conversation(db, conversation_id, current_user)
+
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    if payload.base_message_id is not None:
+        base = db.query(Message.created_at, Message.id).filter(
+            Message.id == payload.base_message_id,
+            Message.conversation_id == conversation_id
+        ).first()
+        if not base:
+            # The client's base no longer exists; it must fall back to a full sync
+            raise HTTPException(status_code=409, detail="Base message not found")
+        query = query.filter(
+            tuple_(Message.created_at, Message.id) > tuple_(base.created_at, base.id)
         )
-        db.add(db_message)
+    existing = query.order_by(Message.created_at, Message.id).all()
+    result = sync_messages(db, conversation, existing, payload.messages)
 
-    db.commit()
-    logger.info(f"Messages updated successfully for conversation {conversation_id}")
-    return {"status": "success"}
+    logger.info(
+        "Messages synced for conversation %s: %s inserted, %s deleted",
+        conversation_id, result["inserted"], result["deleted"]
+    )
+    return result
 
 # Admin API
 @router.get("/admin/all", response_model=List[ConversationSchema])
@@ -94,13 +276,27 @@ def get_all_conversations(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized access attempt to all conversations by: {current_user.username}")
+        logger.warning("Unauthorized access attempt to all conversations by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    logger.info(f"All conversations accessed by admin: {current_user.username}")
+    logger.info("All conversations accessed by admin: %s", current_user.username)
     conversations = db.query(Conversation).all()
     return conversations
 
+@router.get("/admin/summaries", response_model=ConversationPage)
+def get_all_conversation_summaries(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        logger.warning("Unauthorized access attempt to all conversations by: %s", current_user.username)
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    logger.info("All conversation summaries accessed by admin: %s", current_user.username)
+    return list_conversation_summaries(db, None, cursor, limit)
+
 @router.get("/user/{user_id}", response_model=List[ConversationSchema])
 def read_user_conversations(
     user_id: int,
@@ -110,7 +306,7 @@ def read_user_conversations(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized access attempt to user conversations by: {current_user.username}")
+        logger.warning("Unauthorized access attempt to user conversations by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Check if user exists
@@ -127,5 +323,24 @@ def read_user_conversations(
         .all()
     )
     
-    logger.info(f"User conversations accessed by admin: {current_user.username}")
-    return conversations 
\ No newline at end of file
+    logger.info("User conversations accessed by admin: %s", current_user.username)
+    return conversations
+
+@router.get("/user/{user_id}/summaries", response_model=ConversationPage)
+def read_user_conversation_summaries(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        logger.warning("Unauthorized access attempt to user conversations by: %s", current_user.username)
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # Check if user exists
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    logger.info("User conversation summaries accessed by admin: %s", current_user.username)
+    return list_conversation_summaries(db, user_id, cursor, limit)
@@ -18,9 +18,9 @@ def read_roles(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized access attempt to role list by: {current_user.username}")
+        logger.warning("Unauthorized access attempt to role list by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    logger.info(f"Role list accessed by admin: {current_user.username}")
+    logger.info("Role list accessed by admin: %s", current_user.username)
     roles = db.query(Role).offset(skip).limit(limit).all()
     return roles 
\ No newline at end of file
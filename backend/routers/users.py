@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
-from passlib.context import CryptContext
+from typing import Iterable, Iterator, List, Optional
 from config.logger import logger
+import codecs
+import csv
+import itertools
+import json
+import os
 
 from database import get_db
 from models import User, Role
 from schemas import User as UserSchema, UserCreate, UserUpdate
-from dependencies import get_current_user
-from routers.auth import get_password_hash
+from dependencies import get_current_user, invalidate_user
+from passwords import hash_password, hash_passwords
+from services.llm import UnknownProviderError, validate_provider
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "500"))
 
 @router.get("/me", response_model=UserSchema)
 def read_users_me(current_user: User = Depends(get_current_user)):
-    logger.info(f"User profile accessed: {current_user.username}")
+    logger.info("User profile accessed: %s", current_user.username)
     return current_user
 
 @router.get("/", response_model=List[UserSchema])
@@ -26,10 +33,10 @@ def read_users(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized access attempt to user list by: {current_user.username}")
+        logger.warning("Unauthorized access attempt to user list by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    logger.info(f"User list accessed by admin: {current_user.username}")
+    logger.info("User list accessed by admin: %s", current_user.username)
     users = db.query(User).offset(skip).limit(limit).all()
     return users
 
@@ -40,14 +47,14 @@ def read_user(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized access attempt to user details by: {current_user.username}")
+        logger.warning("Unauthorized access attempt to user details by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    logger.info(f"User details accessed by admin: {current_user.username}")
+    logger.info("User details accessed by admin: %s", current_user.username)
     return user
 
 @router.post("/", response_model=UserSchema)
@@ -57,23 +64,23 @@ def create_user(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized user creation attempt by: {current_user.username}")
+        logger.warning("Unauthorized user creation attempt by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Check if username exists
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
-        logger.warning(f"User creation failed: Username already exists - {user.username}")
+        logger.warning("User creation failed: Username already exists - %s", user.username)
         raise HTTPException(status_code=400, detail="Username already exists")
     
     # Check if email exists
     db_user = db.query(User).filter(User.email == user.email).first()
     if db_user:
-        logger.warning(f"User creation failed: Email already exists - {user.email}")
+        logger.warning("User creation failed: Email already exists - %s", user.email)
         raise HTTPException(status_code=400, detail="Email already exists")
     
     # Create new user with hashed password
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = hash_password(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -84,7 +91,7 @@ def create_user(
     db.commit()
     db.refresh(db_user)
     
-    logger.info(f"New user created by admin {current_user.username}: {user.username}")
+    logger.info("New user created by admin %s: %s", current_user.username, user.username)
     return db_user
 
 @router.put("/{user_id}", response_model=UserSchema)
@@ -95,17 +102,23 @@ def update_user(
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized user update attempt by: {current_user.username}")
+        logger.warning("Unauthorized user update attempt by: %s", current_user.username)
         raise HTTPException(status_code=403, detail="Not authorized")
     
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    old_username = db_user.username
     
     # Update user fields
     update_data = user_update.dict(exclude_unset=True)
+    if "llm_provider" in update_data:
+        try:
+            validate_provider(update_data["llm_provider"])
+        except UnknownProviderError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     if "password" in update_data:
-        update_data["hashed_password"] = pwd_context.hash(update_data.pop("password"))
+        update_data["hashed_password"] = hash_password(update_data.pop("password"))
     
     # Update roles if provided
     if "role_ids" in update_data:
@@ -118,12 +131,162 @@ def update_user(
     
     db.commit()
     db.refresh(db_user)
+    invalidate_user(old_username, db_user.username)
     
-    logger.info(f"User updated by admin {current_user.username}: {db_user.username}")
+    logger.info("User updated by admin %s: %s", current_user.username, db_user.username)
     return db_user
 
+def parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+def public_fields(user_data: dict) -> dict:
+    """Echo an import row back without its password"""
+    return {key: value for key, value in user_data.items() if key != "password"}
+
+class UserImporter:
+    """Imports users in batches: one lookup query, one hashing pass and one
+    transaction per batch, with errors reported per row."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.user_role = db.query(Role).filter(Role.name == "user").first()
+        self.seen_usernames = set()
+        self.seen_emails = set()
+        self.success = []
+        self.failed = []
+
+    def fail(self, user_data: dict, error: str):
+        self.failed.append({"user": public_fields(user_data), "error": error})
+
+    def normalize(self, user_data: dict) -> Optional[dict]:
+        username = str(user_data.get("username") or "").strip()
+        # Passwords are hashed exactly as given, like single-user creation
+        password = user_data.get("password")
+        password = "" if password is None else str(password)
+        email = str(user_data.get("email") or "").strip() or None
+        if not username or not password:
+            self.fail(user_data, "Username and password are required")
+            return None
+        if username in self.seen_usernames:
+            self.fail(user_data, "Duplicate username in upload")
+            return None
+        if email and email in self.seen_emails:
+            self.fail(user_data, "Duplicate email in upload")
+            return None
+        self.seen_usernames.add(username)
+        if email:
+            self.seen_emails.add(email)
+        return {
+            "username": username,
+            "password": password,
+            "email": email,
+            "is_admin": parse_bool(user_data.get("is_admin", False)),
+        }
+
+    def new_user(self, row: dict, hashed_password: str) -> User:
+        user = User(
+            username=row["username"],
+            email=row["email"],
+            hashed_password=hashed_password,
+            is_admin=row["is_admin"]
+        )
+        user.roles.append(self.user_role)
+        return user
+
+    def import_batch(self, batch: Iterable[dict]):
+        rows = [row for row in map(self.normalize, batch) if row is not None]
+        if not rows:
+            return
+        if self.user_role is None:
+            for row in rows:
+                self.fail(row, "Default user role not found")
+            return
+
+        usernames = [row["username"] for row in rows]
+        emails = [row["email"] for row in rows if row["email"]]
+        existing_usernames = {
+            name for (name,) in self.db.query(User.username).filter(User.username.in_(usernames))
+        }
+        existing_emails = {
+            email for (email,) in self.db.query(User.email).filter(User.email.in_(emails))
+        } if emails else set()
+
+        candidates = []
+        for row in rows:
+            if row["username"] in existing_usernames:
+                self.fail(row, "Username already exists")
+            elif row["email"] in existing_emails:
+                self.fail(row, "Email already exists")
+            else:
+                candidates.append(row)
+        if not candidates:
+            return
+
+        hashes = hash_passwords([row["password"] for row in candidates])
+        try:
+            self.db.add_all([self.new_user(row, hashed) for row, hashed in zip(candidates, hashes)])
+            self.db.commit()
+            self.success.extend(public_fields(row) for row in candidates)
+        except IntegrityError:
+            # A concurrent import won the race; retry row by row to pinpoint the conflicts
+            self.db.rollback()
+            self.import_rows(candidates, hashes)
+
+    def import_rows(self, rows: List[dict], hashes: List[str]):
+        for row, hashed in zip(rows, hashes):
+            try:
+                with self.db.begin_nested():
+                    self.db.add(self.new_user(row, hashed))
+                self.success.append(public_fields(row))
+            except IntegrityError:
+                self.fail(row, "Username or email already exists")
+        self.db.commit()
+
+    def run(self, users: Iterable[dict]) -> dict:
+        for batch in batched(users, BULK_IMPORT_BATCH_SIZE):
+            self.import_batch(batch)
+        return {"success": self.success, "failed": self.failed}
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def read_json_rows(users: list, importer: UserImporter) -> Iterator[dict]:
+    """Yield the object rows of a JSON bulk request, failing other rows by index"""
+    for index, row in enumerate(users):
+        if not isinstance(row, dict):
+            importer.fail({"index": index}, "Expected a JSON object")
+            continue
+        yield row
+
+def read_upload_rows(upload: UploadFile, importer: UserImporter) -> Iterator[dict]:
+    """Stream rows from a CSV (header: username,password[,email,is_admin]) or NDJSON upload"""
+    text = codecs.getreader("utf-8-sig")(upload.file)
+    filename = (upload.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or upload.content_type in ("application/x-ndjson", "application/jsonl"):
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                importer.fail({"line": line_number}, "Invalid JSON")
+                continue
+            if not isinstance(row, dict):
+                importer.fail({"line": line_number}, "Expected a JSON object")
+                continue
+            yield row
+    else:
+        yield from csv.DictReader(text)
+
 @router.post("/bulk", response_model=dict)
-async def bulk_create_users(
+def bulk_create_users(
     users_data: dict,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -131,49 +294,30 @@ async def bulk_create_users(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only admin can create users in bulk")
 
-    success = []
-    failed = []
-
-    for user_data in users_data["users"]:
-        try:
-            # Check if username already exists
-            if db.query(User).filter(User.username == user_data["username"]).first():
-                failed.append({
-                    "user": user_data,
-                    "error": "Username already exists"
-                })
-                continue
+    users = users_data.get("users", [])
+    if not isinstance(users, list):
+        raise HTTPException(status_code=400, detail="users must be a list")
+    importer = UserImporter(db)
+    result = importer.run(read_json_rows(users, importer))
+    logger.info(
+        "Bulk user import by admin %s: %s created, %s failed",
+        current_user.username, len(result["success"]), len(result["failed"])
+    )
+    return result
 
-            # Get default user role
-            user_role = db.query(Role).filter(Role.name == "user").first()
-            if not user_role:
-                failed.append({
-                    "user": user_data,
-                    "error": "Default user role not found"
-                })
-                continue
+@router.post("/bulk/upload", response_model=dict)
+def bulk_upload_users(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin can create users in bulk")
 
-            # Create new user
-            hashed_password = get_password_hash(user_data["password"])
-            new_user = User(
-                username=user_data["username"],
-                hashed_password=hashed_password,
-                is_admin=user_data.get("is_admin", False)
-            )
-            new_user.roles.append(user_role)
-
-            db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
-
-            success.append(user_data)
-        except Exception as e:
-            failed.append({
-                "user": user_data,
-                "error": str(e)
-            })
-
-    return {
-        "success": success,
-        "failed": failed
-    } 
\ No newline at end of file
+    importer = UserImporter(db)
+    result = importer.run(read_upload_rows(file, importer))
+    logger.info(
+        "Bulk user upload by admin %s: %s created, %s failed",
+        current_user.username, len(result["success"]), len(result["failed"])
+    )
+    return result
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Set
+
+import jwt
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from config.logger import logger
+from database import AsyncSessionLocal, SessionLocal
+from dependencies import decode_token, load_user
+from instrumentation import track_request
+from metrics import Counter, Gauge
+from services.llm_limiter import LLMUnavailableError
+from services.summary_jobs import add_title_listener
+from services.turns import add_message_listener, get_user_conversation, prepare_turn, save_message
+
+# WebSocket 连接配置
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "1000"))
+# 每个连接待发送的事件上限，超过时暂停转发 token；广播事件再超出同样的数量时断开连接
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# 超过该时间（秒）未收到客户端任何消息（包括 ping）时关闭连接
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+# 每个连接同时进行的对话轮次上限
+WS_MAX_ACTIVE_TURNS = int(os.getenv("WS_MAX_ACTIVE_TURNS", "4"))
+# 对话轮次在延迟和查询统计中的路由名
+WS_TURN_ROUTE = "ws:message"
+
+CLOSE_NORMAL = 1000
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_UNAUTHORIZED = 4001
+
+ws_connections = Gauge("ws_connections", "Open chat WebSocket connections")
+ws_slow_consumers = Counter("ws_slow_consumers_total", "WebSocket connections dropped because the client read too slowly")
+
+router = APIRouter()
+
+class ChatConnection:
+    """一个已认证的 WebSocket 连接，可同时进行多个对话的轮次。
+
+    所有发往客户端的事件经由 outbox 队列，由单独的 writer 顺序发送。
+    """
+
+    def __init__(self, websocket: WebSocket, user, expires_at: Optional[float]):
+        self.websocket = websocket
+        self.user = user
+        self.expires_at = expires_at
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.turns: Dict[int, asyncio.Task] = {}
+        self.close_code = CLOSE_NORMAL
+        self._drained = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def send(self, event: dict):
+        """发送本连接请求的事件；队列已满时等待，把背压传递给上游的模型流"""
+        while self.outbox.qsize() >= WS_SEND_QUEUE_SIZE:
+            self._drained.clear()
+            await self._drained.wait()
+        self.outbox.put_nowait(event)
+
+    def push(self, event: dict):
+        """发送广播事件；不能阻塞发布方，客户端积压过多时断开连接，由客户端重连后重新同步"""
+        if self.outbox.qsize() >= WS_SEND_QUEUE_SIZE * 2:
+            if self.close_code == CLOSE_NORMAL:
+                ws_slow_consumers.inc()
+                logger.warning("用户 %s 的 WebSocket 积压过多，断开连接", self.user.username)
+                self.close_code = CLOSE_TRY_AGAIN_LATER
+                if self._writer is not None:
+                    self._writer.cancel()
+            return
+        self.outbox.put_nowait(event)
+
+    async def write_loop(self):
+        while True:
+            event = await self.outbox.get()
+            if self.outbox.qsize() < WS_SEND_QUEUE_SIZE:
+                self._drained.set()
+            await self.websocket.send_text(json.dumps(event, ensure_ascii=False))
+
+    async def read_loop(self):
+        while True:
+            try:
+                raw = await asyncio.wait_for(self.websocket.receive_text(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.info("用户 %s 的 WebSocket 空闲超时", self.user.username)
+                return
+            except WebSocketDisconnect:
+                self.close_code = None
+                return
+            if self.expires_at is not None and time.time() >= self.expires_at:
+                await self.send({"type": "error", "detail": "Token has expired"})
+                self.close_code = CLOSE_UNAUTHORIZED
+                return
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                await self.send({"type": "error", "detail": "无效的 JSON"})
+                continue
+            if not isinstance(frame, dict):
+                await self.send({"type": "error", "detail": "消息必须是 JSON 对象"})
+                continue
+            await self.handle(frame)
+
+    async def handle(self, frame: dict):
+        frame_type = frame.get("type")
+        conversation_id = frame.get("conversation_id")
+        if frame_type == "ping":
+            await self.send({"type": "pong"})
+        elif frame_type == "message":
+            content = frame.get("content")
+            if not isinstance(conversation_id, int) or not isinstance(content, str) or not content:
+                await self.send({"type": "error", "detail": "需要 conversation_id 和 content"})
+            elif conversation_id in self.turns:
+                await self.send({"type": "error", "conversation_id": conversation_id, "detail": "该对话正在生成回复"})
+            elif len(self.turns) >= WS_MAX_ACTIVE_TURNS:
+                await self.send({"type": "error", "conversation_id": conversation_id, "detail": "同时进行的对话过多"})
+            else:
+                self.turns[conversation_id] = asyncio.create_task(
+                    self.timed_turn(conversation_id, content, frame.get("cache", True) is not False)
+                )
+        elif frame_type == "cancel":
+            task = self.turns.get(conversation_id)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.send({"type": "error", "detail": f"未知的消息类型: {frame_type}"})
+
+    async def timed_turn(self, conversation_id: int, content: str, use_cache: bool):
+        """按轮次统计阶段耗时和查询条数，与 HTTP 请求使用相同的指标"""
+        with track_request() as stats:
+            try:
+                await self.run_turn(conversation_id, content, use_cache)
+            finally:
+                stats.observe(WS_TURN_ROUTE)
+
+    async def run_turn(self, conversation_id: int, content: str, use_cache: bool):
+        """一轮对话：保存用户消息、转发模型 token、保存完整回复。
+
+        只在准备和保存时使用数据库会话，转发 token 期间不占用连接池。
+        用户消息和助手消息通过 message 事件推送，本连接另外收到 token 和 done 事件。
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                conversation = await get_user_conversation(db, conversation_id, self.user.id)
+                if not conversation:
+                    await self.send({"type": "error", "conversation_id": conversation_id, "detail": "对话不存在"})
+                    return
+                _, provider, openai_messages = await prepare_turn(
+                    db, conversation, self.user, content, use_cache=use_cache
+                )
+
+            parts = []
+            upstream = provider.stream(openai_messages)
+            try:
+                async for token in upstream:
+                    parts.append(token)
+                    await self.send({"type": "token", "conversation_id": conversation_id, "content": token})
+            finally:
+                await upstream.aclose()
+
+            async with AsyncSessionLocal() as db:
+                ai_message = await save_message(db, self.user.id, conversation_id, "assistant", "".join(parts))
+            logger.info("助手消息已保存: %s", ai_message.id)
+            await self.send({"type": "done", "conversation_id": conversation_id, "message_id": ai_message.id})
+        except asyncio.CancelledError:
+            # 客户端取消或连接断开：上游流已关闭，不保存不完整的回复
+            self.push({"type": "cancelled", "conversation_id": conversation_id})
+            raise
+        except LLMUnavailableError as e:
+            logger.warning("模型服务繁忙: %s", e)
+            await self.send({"type": "error", "conversation_id": conversation_id, "detail": "模型服务繁忙，请稍后重试"})
+        except Exception as e:
+            logger.error("WebSocket 处理消息时发生错误: %s", e)
+            await self.send({"type": "error", "conversation_id": conversation_id, "detail": str(e)})
+        finally:
+            self.turns.pop(conversation_id, None)
+
+    async def serve(self):
+        self._writer = asyncio.create_task(self.write_loop())
+        reader = asyncio.create_task(self.read_loop())
+        try:
+            await asyncio.wait({reader, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in [reader, *self.turns.values()]:
+                task.cancel()
+            await asyncio.gather(reader, *self.turns.values(), return_exceptions=True)
+            # 尽量把已排队的事件（如错误原因）发出去再关闭
+            if self.close_code is not None and not self._writer.done():
+                while not self.outbox.empty():
+                    await self.websocket.send_text(json.dumps(self.outbox.get_nowait(), ensure_ascii=False))
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+# user_id -> 该用户在本 worker 上的连接
+connections: Dict[int, Set[ChatConnection]] = {}
+
+def connection_count() -> int:
+    return sum(len(conns) for conns in connections.values())
+
+async def broadcast_message(user_id: int, message: dict):
+    for conn in list(connections.get(user_id, ())):
+        conn.push({"type": "message", "message": message})
+
+async def broadcast_title(user_id: int, conversation_id: int, title: str):
+    for conn in list(connections.get(user_id, ())):
+        conn.push({"type": "title", "conversation_id": conversation_id, "title": title})
+
+add_message_listener(broadcast_message)
+add_title_listener(broadcast_title)
+
+def _load_user(username: str):
+    db = SessionLocal()
+    try:
+        return load_user(db, username)
+    finally:
+        db.close()
+
+async def authenticate(token: Optional[str]):
+    """验证 token，返回 (user, 过期时间)；无效时返回 (None, None)"""
+    if not token:
+        return None, None
+    try:
+        payload = decode_token(token)
+    except jwt.InvalidTokenError as e:
+        logger.warning("WebSocket token 无效: %s", e)
+        return None, None
+    username = payload.get("sub")
+    if username is None:
+        return None, None
+    user = await run_in_threadpool(_load_user, username)
+    return user, payload.get("exp")
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """聊天 WebSocket。
+
+    认证：连接地址带 ?token=，或连接后第一条消息为 {"type": "auth", "token": ...}。
+    客户端消息：message（conversation_id, content[, cache]）、cancel（conversation_id）、ping。
+    服务端事件：ready、token、done、message（新消息）、title（标题更新）、cancelled、error、pong。
+    """
+    await websocket.accept()
+    if connection_count() >= WS_MAX_CONNECTIONS:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+
+    token = websocket.query_params.get("token")
+    if token is None:
+        try:
+            frame = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+            token = frame.get("token") if isinstance(frame, dict) and frame.get("type") == "auth" else None
+        except (asyncio.TimeoutError, ValueError):
+            token = None
+        except WebSocketDisconnect:
+            return
+    user, expires_at = await authenticate(token)
+    if user is None:
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+
+    conn = ChatConnection(websocket, user, expires_at)
+    connections.setdefault(user.id, set()).add(conn)
+    ws_connections.set(connection_count())
+    logger.info("用户 %s 建立了 WebSocket 连接", user.username)
+    try:
+        await websocket.send_text(json.dumps({"type": "ready", "user_id": user.id}))
+        await conn.serve()
+    except WebSocketDisconnect:
+        conn.close_code = None
+    finally:
+        conns = connections.get(user.id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del connections[user.id]
+        ws_connections.set(connection_count())
+        if conn.close_code is not None:
+            try:
+                await websocket.close(code=conn.close_code)
+            except Exception:
+                pass
+        logger.info("用户 %s 的 WebSocket 连接已关闭", user.username)
@@ -12,6 +12,7 @@ class Role(RoleBase):
 
     class Config:
         from_attributes = True
+        orm_mode = True
 
 class UserBase(BaseModel):
     username: str
@@ -25,10 +26,12 @@ class UserCreate(UserBase):
 class User(UserBase):
     id: int
     is_active: bool
+    llm_provider: Optional[str] = None
     roles: List[Role]  # 修改为Role类型
 
     class Config:
         from_attributes = True
+        orm_mode = True
 
 class UserUpdate(BaseModel):
     username: Optional[str] = None
@@ -36,9 +39,11 @@ class UserUpdate(BaseModel):
     password: Optional[str] = None
     is_active: Optional[bool] = None
     role_ids: Optional[List[int]] = None
+    llm_provider: Optional[str] = None
 
     class Config:
         from_attributes = True
+        orm_mode = True
 
 class ChatMessage(BaseModel):
     message: str 
@@ -50,6 +55,10 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     pass
 
+class MessageSync(BaseModel):
+    base_message_id: Optional[int] = None  # 客户端已确认与服务端一致的最后一条消息
+    messages: List[MessageCreate] = []
+
 class Message(MessageBase):
     id: int
     conversation_id: int
@@ -57,27 +66,65 @@ class Message(MessageBase):
 
     class Config:
         from_attributes = True
+        orm_mode = True
 
 class ConversationBase(BaseModel):
     title: str
 
 class ConversationCreate(ConversationBase):
-    pass
+    llm_provider: Optional[str] = None
 
 class Conversation(ConversationBase):
     id: int
     user_id: int
     created_at: datetime
     updated_at: datetime
+    llm_provider: Optional[str] = None
     messages: List[Message] = []
 
     class Config:
         from_attributes = True
+        orm_mode = True
 
 class ConversationResponse(ConversationBase):
     id: int
     user_id: int
     created_at: datetime
+    llm_provider: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+        orm_mode = True
+
+class ConversationSummary(BaseModel):
+    id: int
+    title: str
+    user_id: int
+    updated_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    message_count: int = 0
+    token_total: int = 0
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+        orm_mode = True
+
+class ConversationPage(BaseModel):
+    items: List[ConversationSummary]
+    next_cursor: Optional[str] = None
+
+class SearchResult(BaseModel):
+    type: str  # 'message' or 'conversation' (title match)
+    conversation_id: int
+    title: str
+    message_id: Optional[int] = None
+    role: Optional[str] = None
+    snippet: str  # HTML-escaped, matches wrapped in <mark>
+    rank: float
+    created_at: Optional[datetime] = None
+
+class SearchPage(BaseModel):
+    query: str
+    items: List[SearchResult]
+    next_offset: Optional[int] = None
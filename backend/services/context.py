@@ -0,0 +1,171 @@
+import math
+import os
+import re
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.logger import logger
+from instrumentation import measure_stage
+from metrics import Counter
+from models import Conversation
+from services.llm import LLMProvider, LLM_SUMMARY_TEMPERATURE
+from services.retrieval import RETRIEVAL_ENABLED, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K, retrieve_snippets
+
+# 上下文窗口配置
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# 折叠旧消息后，最近的消息保留在预算的这一比例内，避免每一轮都重新生成摘要
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", "0.5"))
+# 每条消息的格式开销（role 等字段）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你是一个专业的对话总结助手。请将以下对话内容合并进已有摘要，生成一段简洁的摘要（不超过300字）。"
+    "摘要应该保留用户提供的关键信息、偏好和尚未解决的问题。"
+)
+
+RETRIEVAL_HEADER = "以下是用户在其他对话中的相关内容，仅在与当前问题相关时参考："
+# 剩余预算少于该值时不检索
+RETRIEVAL_MIN_BUDGET = 50
+
+retrieval_injected = Counter("retrieval_snippets_injected_total", "Past snippets added to model context")
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+_encoding = None
+
+def _get_encoding():
+    """按需加载 tiktoken 编码；未安装时返回 None，使用估算"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+def count_tokens(text: Optional[str]) -> int:
+    """统计文本的 token 数；没有 tiktoken 时按中文每字 1 个、其他字符每 4 个 1 个估算"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD
+
+def split_for_budget(messages: List[dict], budget: int) -> int:
+    """返回能放进预算的最近消息的起始下标，至少保留最后一条消息"""
+    used = 0
+    for i in range(len(messages) - 1, -1, -1):
+        used += message_tokens(messages[i])
+        if used > budget and i < len(messages) - 1:
+            return i + 1
+    return 0
+
+async def fold_into_summary(provider: LLMProvider, summary: Optional[str], messages: List[dict]) -> str:
+    """将一段旧消息合并进已有摘要"""
+    conversation_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    if summary:
+        conversation_text = f"已有摘要：\n{summary}\n\n新增对话：\n{conversation_text}"
+
+    response = await provider.complete(
+        [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": conversation_text}
+        ],
+        temperature=LLM_SUMMARY_TEMPERATURE
+    )
+    return response.strip()
+
+def assemble(summary: Optional[str], messages: List[dict]) -> List[dict]:
+    """拼装发送给模型的消息列表：摘要（如有）+ 最近的消息"""
+    context = []
+    if summary:
+        context.append({"role": "system", "content": f"以下是之前对话的摘要：\n{summary}"})
+    context.extend({"role": msg["role"], "content": msg["content"]} for msg in messages)
+    return context
+
+async def build_context(
+    db: AsyncSession,
+    conversation: Conversation,
+    history: List[dict],
+    provider: LLMProvider
+) -> List[dict]:
+    """在 token 预算内构建上下文：本对话的摘要和最近消息，预算有剩余时加上其他对话中的相关片段"""
+    context = await build_history_context(db, conversation, history, provider)
+    if not RETRIEVAL_ENABLED or not history:
+        return context
+    budget = min(RETRIEVAL_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET - sum(message_tokens(msg) for msg in context))
+    if budget < RETRIEVAL_MIN_BUDGET:
+        return context
+    try:
+        with measure_stage("retrieval"):
+            snippets = await retrieve_snippets(db, conversation.user_id, conversation.id, history[-1]["content"])
+    except Exception as e:
+        logger.error("检索对话 %s 的相关片段失败: %s", conversation.id, e)
+        return context
+    memory = fit_snippets(snippets, budget)
+    if not memory:
+        return context
+    retrieval_injected.inc(len(memory))
+    content = RETRIEVAL_HEADER + "\n" + "\n".join(memory)
+    return [{"role": "system", "content": content}] + context
+
+def fit_snippets(snippets: List[str], budget: int) -> List[str]:
+    """按相关度依次选取能放进预算的片段，最多 RETRIEVAL_TOP_K 条"""
+    selected = []
+    used = count_tokens(RETRIEVAL_HEADER) + MESSAGE_TOKEN_OVERHEAD
+    for snippet in snippets:
+        tokens = count_tokens(snippet) + 1
+        if used + tokens > budget:
+            continue
+        selected.append(snippet)
+        used += tokens
+        if len(selected) >= RETRIEVAL_TOP_K:
+            break
+    return selected
+
+async def build_history_context(
+    db: AsyncSession,
+    conversation: Conversation,
+    history: List[dict],
+    provider: LLMProvider
+) -> List[dict]:
+    """在 token 预算内构建本对话的上下文。
+
+    history 为按时间排序的 {"id", "role", "content"} 列表。尚未折叠的消息超出预算时，
+    只保留预算 CONTEXT_KEEP_RATIO 以内的最近消息，其余的增量合并进对话的滚动摘要并持久化；
+    之后的若干轮都复用该摘要，直到未折叠的消息再次超出预算。
+    """
+    summary = conversation.summary
+    pending = [
+        msg for msg in history
+        if conversation.summary_message_id is None or msg["id"] > conversation.summary_message_id
+    ]
+    summary_tokens = count_tokens(summary)
+    if summary_tokens + sum(message_tokens(msg) for msg in pending) <= CONTEXT_TOKEN_BUDGET:
+        return assemble(summary, pending)
+
+    keep_budget = max(int(CONTEXT_TOKEN_BUDGET * CONTEXT_KEEP_RATIO) - summary_tokens, 0)
+    start = split_for_budget(pending, keep_budget)
+    folded, recent = pending[:start], pending[start:]
+    if not folded:
+        return assemble(summary, recent)
+
+    try:
+        summary = await fold_into_summary(provider, summary, folded)
+    except Exception as e:
+        # 摘要失败时仅截断，不影响本轮对话
+        logger.error("更新对话 %s 的滚动摘要失败: %s", conversation.id, e)
+        return assemble(conversation.summary, recent)
+
+    conversation.summary = summary
+    conversation.summary_message_id = folded[-1]["id"]
+    await db.commit()
+    logger.info("对话 %s 的 %s 条消息已折叠进摘要", conversation.id, len(folded))
+    return assemble(summary, recent)
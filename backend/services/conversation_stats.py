@@ -0,0 +1,100 @@
+"""对话的冗余统计：消息数、最后一条消息的时间和预览、消息内容的 token 总数。
+
+写入或删除消息时，调用方在同一事务中执行 stats_update 生成的 UPDATE，计数以增量方式原子更新，
+并发写入同一对话时不会丢失。已有数据由 python manage.py backfill-stats 填充。
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from models import Conversation, Message
+from services.context import count_tokens
+
+PREVIEW_LENGTH = 100
+
+def preview(content: Optional[str]) -> Optional[str]:
+    return content[:PREVIEW_LENGTH] if content is not None else None
+
+def _last_message(conversation_id: int, column):
+    """对话中最后一条消息的某一列（走 conversation_id, created_at, id 索引）"""
+    return (
+        select(column)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+def stats_update(conversation_id: int, added: List[Message], removed: Iterable[Message] = ()):
+    """新增 added（已 flush，按时间顺序）、删除 removed 之后对话统计的 UPDATE 语句"""
+    removed = list(removed)
+    now = datetime.utcnow()
+    values = {
+        "message_count": Conversation.message_count + (len(added) - len(removed)),
+        "token_total": Conversation.token_total + (
+            sum(count_tokens(msg.content) for msg in added) - sum(count_tokens(msg.content) for msg in removed)
+        ),
+        # 按最近活动排序的列表依赖 updated_at
+        "updated_at": now,
+    }
+    if added:
+        last = added[-1]
+        if removed:
+            # 删除的可能正是原来的最后一条，直接以新消息为准
+            values["last_message_at"] = last.created_at
+            values["last_message_preview"] = preview(last.content)
+        else:
+            # 并发追加时以时间最新的消息为准
+            newer = or_(Conversation.last_message_at.is_(None), Conversation.last_message_at <= last.created_at)
+            values["last_message_at"] = case((newer, last.created_at), else_=Conversation.last_message_at)
+            values["last_message_preview"] = case(
+                (newer, preview(last.content)), else_=Conversation.last_message_preview
+            )
+    elif removed:
+        # 只删除了消息：从剩余消息中重新取最后一条
+        values["last_message_at"] = _last_message(conversation_id, Message.created_at)
+        values["last_message_preview"] = _last_message(
+            conversation_id, func.substr(Message.content, 1, PREVIEW_LENGTH)
+        )
+    return (
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+def backfill(db: Session, batch_size: int = 500) -> int:
+    """按对话 id 分批重新计算所有对话的统计并提交，返回处理的对话数"""
+    processed = 0
+    after_id = 0
+    while True:
+        ids = [row.id for row in db.execute(
+            select(Conversation.id).where(Conversation.id > after_id).order_by(Conversation.id).limit(batch_size)
+        )]
+        if not ids:
+            return processed
+        stats = {cid: {"message_count": 0, "token_total": 0, "last_message_at": None,
+                       "last_message_preview": None} for cid in ids}
+        messages = db.execute(
+            select(Message.conversation_id, Message.content, Message.created_at)
+            .where(Message.conversation_id.in_(ids))
+            .order_by(Message.conversation_id, Message.created_at, Message.id)
+        )
+        for msg in messages:
+            entry = stats[msg.conversation_id]
+            entry["message_count"] += 1
+            entry["token_total"] += count_tokens(msg.content)
+            entry["last_message_at"] = msg.created_at
+            entry["last_message_preview"] = preview(msg.content)
+        for cid, values in stats.items():
+            # 不修改 updated_at：回填不是对话的新活动
+            db.execute(
+                update(Conversation.__table__)
+                .where(Conversation.__table__.c.id == cid)
+                .values(updated_at=Conversation.__table__.c.updated_at, **values)
+            )
+        db.commit()
+        processed += len(ids)
+        after_id = ids[-1]
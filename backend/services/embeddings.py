@@ -0,0 +1,84 @@
+import math
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter as TermCounter
+from typing import List
+
+import numpy as np
+
+from config.logger import logger
+
+# 本地 sentence-transformers 模型（名称或路径）；未设置或未安装时使用确定性的哈希向量
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+# 哈希向量的维度
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+CJK_RUN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+
+class Embedder(ABC):
+    """把文本转换为 L2 归一化的向量，内积即余弦相似度"""
+
+    name = "base"
+    dim = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        ...
+
+def text_features(text: str) -> List[str]:
+    """英文等按单词，中文按相邻两个字（单字的文本取单字）"""
+    lowered = text.lower()
+    features = WORD_PATTERN.findall(lowered)
+    for run in CJK_RUN_PATTERN.findall(lowered):
+        if len(run) == 1:
+            features.append(run)
+        else:
+            features.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return features
+
+class HashingEmbedder(Embedder):
+    """特征哈希（带符号）得到的词袋向量。
+
+    不需要模型文件，相同文本在任何进程中结果相同，适合离线测试；只反映字面相似度。
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature, count in TermCounter(text_features(text)).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[i, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+class SentenceTransformerEmbedder(Embedder):
+    """本地 sentence-transformers 模型，在调用方的线程中计算"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32, copy=False)
+
+def create_embedder() -> Embedder:
+    if EMBEDDING_MODEL:
+        try:
+            return SentenceTransformerEmbedder(EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning("Embedding model %s unavailable (%s), using hashing embeddings", EMBEDDING_MODEL, e)
+    return HashingEmbedder(EMBEDDING_DIM)
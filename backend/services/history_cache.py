@@ -0,0 +1,136 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from config.logger import logger
+from metrics import Counter
+from services.cache import TTLCache
+
+# 对话历史缓存配置
+HISTORY_CACHE_BACKEND = os.getenv("HISTORY_CACHE_BACKEND", "memory")  # memory / redis / none
+HISTORY_CACHE_MAX_CONVERSATIONS = int(os.getenv("HISTORY_CACHE_MAX_CONVERSATIONS", "1000"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+history_cache_hits = Counter("history_cache_hits_total", "Conversation history served from cache")
+history_cache_misses = Counter("history_cache_misses_total", "Conversation history loaded from the database")
+
+class HistoryCache(ABC):
+    """对话历史缓存接口。
+
+    缓存条目是按时间排序的消息列表，每条消息为 {"id", "role", "content"}。
+    append 只追加到已缓存的对话，未缓存时什么也不做，下一次 get 未命中后从数据库完整加载。
+    """
+
+    @abstractmethod
+    async def get(self, conversation_id: int) -> Optional[List[dict]]:
+        ...
+
+    @abstractmethod
+    async def set(self, conversation_id: int, messages: List[dict]):
+        ...
+
+    @abstractmethod
+    async def append(self, conversation_id: int, messages: List[dict]):
+        ...
+
+    @abstractmethod
+    async def invalidate(self, conversation_id: int):
+        ...
+
+class NullHistoryCache(HistoryCache):
+    """不缓存，每次都从数据库读取"""
+
+    async def get(self, conversation_id: int) -> Optional[List[dict]]:
+        return None
+
+    async def set(self, conversation_id: int, messages: List[dict]):
+        pass
+
+    async def append(self, conversation_id: int, messages: List[dict]):
+        pass
+
+    async def invalidate(self, conversation_id: int):
+        pass
+
+class MemoryHistoryCache(HistoryCache):
+    """进程内 LRU 缓存。
+
+    多 worker 部署时各 worker 的缓存互不可见，其他 worker 写入的消息由读取方
+    （services.turns.get_history_entries）按对话的消息数和最后一条消息 id 发现并重新加载；
+    使用 RedisHistoryCache 可以在 worker 之间共享已加载的历史。
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, conversation_id: int) -> Optional[List[dict]]:
+        messages = self._cache.get(conversation_id)
+        return None if messages is None else list(messages)
+
+    async def set(self, conversation_id: int, messages: List[dict]):
+        self._cache.set(conversation_id, list(messages))
+
+    async def append(self, conversation_id: int, messages: List[dict]):
+        self._cache.update(conversation_id, lambda cached: cached + list(messages))
+
+    async def invalidate(self, conversation_id: int):
+        self._cache.pop(conversation_id)
+
+class RedisHistoryCache(HistoryCache):
+    """基于 Redis 列表的共享缓存，所有 worker 共用"""
+
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._ttl = int(ttl)
+
+    def _key(self, conversation_id: int) -> str:
+        return f"chat:history:{conversation_id}"
+
+    async def get(self, conversation_id: int) -> Optional[List[dict]]:
+        items = await self._redis.lrange(self._key(conversation_id), 0, -1)
+        if not items:
+            return None
+        return [json.loads(item) for item in items]
+
+    async def set(self, conversation_id: int, messages: List[dict]):
+        key = self._key(conversation_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if messages:
+                pipe.rpush(key, *[json.dumps(msg, ensure_ascii=False) for msg in messages])
+                pipe.expire(key, self._ttl)
+            await pipe.execute()
+
+    async def append(self, conversation_id: int, messages: List[dict]):
+        if not messages:
+            return
+        key = self._key(conversation_id)
+        # RPUSHX 只在键已存在时追加
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpushx(key, *[json.dumps(msg, ensure_ascii=False) for msg in messages])
+            pipe.expire(key, self._ttl)
+            await pipe.execute()
+
+    async def invalidate(self, conversation_id: int):
+        await self._redis.delete(self._key(conversation_id))
+
+def create_history_cache() -> HistoryCache:
+    if HISTORY_CACHE_BACKEND == "none":
+        return NullHistoryCache()
+    if HISTORY_CACHE_BACKEND == "redis":
+        try:
+            cache = RedisHistoryCache(REDIS_URL, HISTORY_CACHE_TTL)
+            logger.info("Using Redis conversation history cache: %s", REDIS_URL)
+            return cache
+        except ImportError:
+            logger.warning("redis package not installed, falling back to in-memory history cache")
+    return MemoryHistoryCache(HISTORY_CACHE_MAX_CONVERSATIONS, HISTORY_CACHE_TTL)
+
+history_cache = create_history_cache()
+
+def to_cache_entry(msg) -> dict:
+    return {"id": msg.id, "role": msg.role, "content": msg.content}
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional
+
+from config.logger import logger
+
+# 模型与采样参数
+LLM_PROVIDER = os.getenv("LLM_PROVIDER") or ("openai" if os.getenv("OPENAI_API_KEY") else "mock")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+LLM_SUMMARY_TEMPERATURE = float(os.getenv("LLM_SUMMARY_TEMPERATURE", "0.3"))
+
+# HTTP 连接池配置（每个 provider 一个长连接客户端）
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+# SDK 自带的重试；默认关闭，由 services.llm_limiter 统一退避重试
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+
+# OpenAI 兼容的本地推理服务（如 vLLM、llama.cpp server）
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL")
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "not-needed")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", LLM_MODEL)
+
+# 模拟模型：首个 token 前的延迟和每个 token 的间隔（秒），用于压测
+MOCK_LLM_LATENCY = float(os.getenv("MOCK_LLM_LATENCY", "0"))
+MOCK_LLM_TOKEN_DELAY = float(os.getenv("MOCK_LLM_TOKEN_DELAY", "0"))
+
+class LLMProvider(ABC):
+    """聊天模型提供方接口"""
+
+    name = ""
+    model = ""
+
+    @abstractmethod
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        ...
+
+    @abstractmethod
+    def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        ...
+
+    async def aclose(self):
+        pass
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI 及 OpenAI 兼容接口，复用一个支持 keep-alive / HTTP/2 的连接池"""
+
+    def __init__(self, name: str, api_key: str, model: str, base_url: Optional[str] = None):
+        self.name = name
+        self.model = model
+        self._api_key = api_key
+        self._base_url = base_url
+        self._client = None
+
+    def _create_http_client(self):
+        import httpx
+
+        http2 = LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 package not installed, LLM client falls back to HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    @property
+    def client(self):
+        # 延迟导入 openai 并在首次使用时创建客户端
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(
+                api_key=self._api_key,
+                base_url=self._base_url,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=self._create_http_client(),
+            )
+        return self._client
+
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=LLM_TEMPERATURE if temperature is None else temperature
+        )
+        return response.choices[0].message.content
+
+    async def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        upstream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=LLM_TEMPERATURE if temperature is None else temperature,
+            stream=True
+        )
+        try:
+            async for chunk in upstream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await upstream.close()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+def get_mock_response(message: str) -> str:
+    """当OpenAI API不可用时返回模拟响应"""
+    return f"模拟响应: {message}"
+
+class MockProvider(LLMProvider):
+    """确定性的本地模拟模型，不访问网络，回复内容只取决于最后一条消息"""
+
+    name = "mock"
+    model = "mock"
+
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        return "".join([token async for token in self.stream(messages, temperature)])
+
+    async def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        if MOCK_LLM_LATENCY:
+            await asyncio.sleep(MOCK_LLM_LATENCY)
+        reply = get_mock_response(messages[-1]["content"] if messages else "")
+        for i, token in enumerate(reply):
+            if i and MOCK_LLM_TOKEN_DELAY:
+                await asyncio.sleep(MOCK_LLM_TOKEN_DELAY)
+            yield token
+
+def create_providers() -> Dict[str, LLMProvider]:
+    providers: Dict[str, LLMProvider] = {"mock": MockProvider()}
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        providers["openai"] = OpenAIProvider("openai", api_key, LLM_MODEL)
+    else:
+        logger.warning("OpenAI API密钥未设置，将使用模拟响应")
+    if LOCAL_LLM_BASE_URL:
+        providers["local"] = OpenAIProvider("local", LOCAL_LLM_API_KEY, LOCAL_LLM_MODEL, base_url=LOCAL_LLM_BASE_URL)
+    return providers
+
+providers = create_providers()
+
+def available_providers() -> List[str]:
+    return sorted(providers)
+
+class UnknownProviderError(ValueError):
+    """请求指定了未配置的 provider，路由转换为 400"""
+
+def validate_provider(name: Optional[str]):
+    """未配置的 provider 名称抛出 UnknownProviderError；None 表示使用用户或全局默认值"""
+    if name is not None and name not in providers:
+        raise UnknownProviderError(f"Unknown LLM provider: {name}")
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """按名称获取 provider；未指定或不可用时使用默认 provider"""
+    provider = providers.get(name or LLM_PROVIDER)
+    if provider is None:
+        if name:
+            logger.warning("LLM provider %s is not configured, using default", name)
+        provider = providers.get(LLM_PROVIDER) or providers["mock"]
+    return provider
+
+def resolve_provider(conversation, user) -> LLMProvider:
+    """对话上的设置优先，其次是用户的设置，最后是默认 provider"""
+    return get_provider(
+        getattr(conversation, "llm_provider", None) or getattr(user, "llm_provider", None)
+    )
+
+async def close_providers():
+    for provider in providers.values():
+        await provider.aclose()
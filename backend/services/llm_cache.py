@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import re
+from typing import AsyncIterator, List, Optional
+
+from metrics import Counter
+from services.cache import TTLCache
+from services.llm import LLMProvider, LLM_TEMPERATURE
+
+# 模型回复缓存配置
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+
+llm_cache_hits = Counter("llm_cache_hits_total", "LLM replies served from the response cache")
+llm_cache_misses = Counter("llm_cache_misses_total", "LLM calls that missed the response cache")
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+response_cache = TTLCache(max_size=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+
+def normalize_messages(messages: List[dict]) -> List[dict]:
+    """合并连续空白并去掉首尾空白，使只差空格的提示命中同一条缓存"""
+    return [
+        {"role": msg["role"], "content": WHITESPACE_PATTERN.sub(" ", msg["content"] or "").strip()}
+        for msg in messages
+    ]
+
+def cache_key(provider: LLMProvider, messages: List[dict], temperature: Optional[float]) -> str:
+    """按 (提供方, 模型, 采样参数, 规范化后的消息) 计算内容地址"""
+    payload = {
+        "provider": provider.name,
+        "model": provider.model,
+        "temperature": LLM_TEMPERATURE if temperature is None else temperature,
+        "messages": normalize_messages(messages),
+    }
+    return hashlib.sha256(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+class CachedProvider(LLMProvider):
+    """在 provider 外层加上回复缓存；命中时不占用排队槽位，也不请求上游"""
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.name = provider.name
+        self.model = provider.model
+
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        key = cache_key(self.provider, messages, temperature)
+        reply = response_cache.get(key)
+        if reply is not None:
+            llm_cache_hits.inc()
+            return reply
+        llm_cache_misses.inc()
+        reply = await self.provider.complete(messages, temperature)
+        response_cache.set(key, reply)
+        return reply
+
+    async def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        key = cache_key(self.provider, messages, temperature)
+        reply = response_cache.get(key)
+        if reply is not None:
+            llm_cache_hits.inc()
+            yield reply
+            return
+        llm_cache_misses.inc()
+        parts = []
+        upstream = self.provider.stream(messages, temperature)
+        try:
+            async for token in upstream:
+                parts.append(token)
+                yield token
+        finally:
+            await upstream.aclose()
+        # 只缓存完整生成的回复
+        response_cache.set(key, "".join(parts))
+
+def cached(provider: LLMProvider, enabled: bool = True) -> LLMProvider:
+    """启用缓存时返回带缓存的 provider，否则原样返回"""
+    if not (LLM_CACHE_ENABLED and enabled):
+        return provider
+    return CachedProvider(provider)
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from config.logger import logger
+from metrics import Counter, Gauge, Histogram
+from services.context import count_tokens
+from services.llm import LLMProvider
+
+# 每个 worker 同时进行的模型调用上限，以及单个用户的上限
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", "2"))
+# 排队超过该时间（秒）仍未轮到时放弃
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# 与提供方配额对齐的每分钟请求数 / token 数（按 worker 数均分后填写），0 表示不限制
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+# 估算 TPM 时为回复预留的 token 数
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "500"))
+# 429 / 5xx / 网络错误的重试
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+llm_queue_wait_seconds = Histogram("llm_queue_wait_seconds", "Time LLM calls wait for a concurrency slot and rate budget")
+llm_queue_depth = Gauge("llm_queue_depth", "LLM calls waiting for a concurrency slot")
+llm_active_calls = Gauge("llm_active_calls", "LLM calls in flight")
+llm_rejected = Counter("llm_rejected_total", "LLM calls that gave up waiting in the queue")
+llm_retries = Counter("llm_retries_total", "LLM call attempts retried after 429/5xx/network errors")
+
+class LLMUnavailableError(Exception):
+    """排队超时，或重试后上游仍然限流/出错"""
+
+class FairLimiter:
+    """带用户级上限的并发限制器。
+
+    空闲槽位按用户轮转分配：每个有等待请求的用户依次获得一个槽位，
+    单个用户的突发请求不会挤占其他用户。
+    """
+
+    def __init__(self, max_concurrency: int, max_per_user: int):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self._active = 0
+        self._active_by_user: Dict[int, int] = defaultdict(int)
+        # 有等待请求的用户，按轮转顺序排列
+        self._waiters: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+
+    def _queued(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def _update_gauges(self):
+        llm_active_calls.set(self._active)
+        llm_queue_depth.set(self._queued())
+
+    def _grant(self, user_id: int):
+        self._active += 1
+        self._active_by_user[user_id] += 1
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._waiters:
+            for user_id, queue in self._waiters.items():
+                if self._active_by_user[user_id] < self.max_per_user:
+                    break
+            else:
+                return
+            waiter = queue.popleft()
+            if not queue:
+                del self._waiters[user_id]
+            else:
+                self._waiters.move_to_end(user_id)
+            if waiter.done():
+                continue
+            self._grant(user_id)
+            waiter.set_result(None)
+
+    async def acquire(self, user_id: int, timeout: float):
+        if (
+            not self._waiters
+            and self._active < self.max_concurrency
+            and self._active_by_user[user_id] < self.max_per_user
+        ):
+            self._grant(user_id)
+            self._update_gauges()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(waiter)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配到槽位但调用方放弃了，归还槽位
+                self.release(user_id)
+            else:
+                queue = self._waiters.get(user_id)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[user_id]
+            raise
+        finally:
+            self._update_gauges()
+
+    def release(self, user_id: int):
+        self._active -= 1
+        self._active_by_user[user_id] -= 1
+        if not self._active_by_user[user_id]:
+            del self._active_by_user[user_id]
+        self._dispatch()
+        self._update_gauges()
+
+class TokenBucket:
+    """令牌桶，容量为每分钟配额，匀速补充；等待者按先后顺序取令牌"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def take(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+limiter = FairLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_CONCURRENCY_PER_USER)
+request_bucket = TokenBucket(LLM_RPM_LIMIT) if LLM_RPM_LIMIT > 0 else None
+token_bucket = TokenBucket(LLM_TPM_LIMIT) if LLM_TPM_LIMIT > 0 else None
+
+def is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "APIConnectionError", "APITimeoutError"
+    )
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """指数退避加完全抖动；上游给出 Retry-After 时不早于它"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return max(delay, min(float(retry_after), LLM_RETRY_MAX_DELAY)) if retry_after else delay
+    except ValueError:
+        return delay
+
+async def acquire_slot(user_id: int, messages: List[dict]):
+    """等待并发槽位和速率配额，超时抛出 LLMUnavailableError"""
+    started = time.perf_counter()
+    try:
+        await limiter.acquire(user_id, LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        llm_rejected.inc()
+        raise LLMUnavailableError("LLM queue timeout")
+    try:
+        if request_bucket is not None:
+            await request_bucket.take(1)
+        if token_bucket is not None:
+            prompt_tokens = sum(count_tokens(msg["content"]) for msg in messages)
+            await token_bucket.take(prompt_tokens + LLM_COMPLETION_TOKEN_ESTIMATE)
+    except BaseException:
+        limiter.release(user_id)
+        raise
+    llm_queue_wait_seconds.observe(time.perf_counter() - started)
+
+class LimitedProvider(LLMProvider):
+    """在 provider 外层加上排队、限速和重试"""
+
+    def __init__(self, provider: LLMProvider, user_id: int):
+        self.provider = provider
+        self.user_id = user_id
+        self.name = provider.name
+        self.model = provider.model
+
+    async def _backoff(self, attempt: int, error: Exception):
+        if attempt + 1 >= LLM_RETRY_ATTEMPTS or not is_retryable(error):
+            if is_retryable(error):
+                raise LLMUnavailableError(str(error)) from error
+            raise error
+        delay = retry_delay(attempt, error)
+        llm_retries.inc()
+        logger.warning("LLM call failed (%s), retrying in %.2fs", error, delay)
+        await asyncio.sleep(delay)
+
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        for attempt in range(LLM_RETRY_ATTEMPTS):
+            await acquire_slot(self.user_id, messages)
+            try:
+                return await self.provider.complete(messages, temperature)
+            except Exception as e:
+                error = e
+            finally:
+                limiter.release(self.user_id)
+            # 退避期间不占用槽位
+            await self._backoff(attempt, error)
+        raise LLMUnavailableError("LLM retries exhausted")
+
+    async def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        # 只在收到第一个 token 之前重试，之后的错误直接抛给调用方
+        for attempt in range(LLM_RETRY_ATTEMPTS):
+            await acquire_slot(self.user_id, messages)
+            started = False
+            upstream = self.provider.stream(messages, temperature)
+            try:
+                async for token in upstream:
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                if started:
+                    raise
+                error = e
+            finally:
+                await upstream.aclose()
+                limiter.release(self.user_id)
+            await self._backoff(attempt, error)
+        raise LLMUnavailableError("LLM retries exhausted")
+
+def limited(provider: LLMProvider, user_id: int) -> LLMProvider:
+    return LimitedProvider(provider, user_id)
@@ -0,0 +1,40 @@
+import time
+from typing import AsyncIterator, List, Optional
+
+from instrumentation import record_stage
+from services.llm import LLMProvider
+
+class TimedProvider(LLMProvider):
+    """在最外层记录模型调用耗时：llm_first_token（流式首个 token）和 llm_total。
+
+    包含排队、重试和缓存命中的时间，即用户实际等待的时间。
+    """
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.name = provider.name
+        self.model = provider.model
+
+    async def complete(self, messages: List[dict], temperature: Optional[float] = None) -> str:
+        started = time.perf_counter()
+        try:
+            return await self.provider.complete(messages, temperature)
+        finally:
+            record_stage("llm_total", time.perf_counter() - started)
+
+    async def stream(self, messages: List[dict], temperature: Optional[float] = None) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        first_token = True
+        upstream = self.provider.stream(messages, temperature)
+        try:
+            async for token in upstream:
+                if first_token:
+                    record_stage("llm_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield token
+        finally:
+            await upstream.aclose()
+            record_stage("llm_total", time.perf_counter() - started)
+
+def timed(provider: LLMProvider) -> LLMProvider:
+    return TimedProvider(provider)
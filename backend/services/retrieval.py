@@ -0,0 +1,181 @@
+"""跨对话检索：后台为消息建立向量索引，构建上下文时取出用户在其他对话中的相关片段。
+
+每个节点（VECTOR_INDEX_DIR）只有一个进程写入索引：持有 index.lock 的 worker 批量读取新消息、
+计算向量并追加；其他 worker 只读，定期映射新写入的部分。写入方退出后由其他 worker 接替。
+被删除的消息仍留在索引中，取片段时按数据库过滤。
+
+numpy 和向量模块在 start() 中才导入，未启用检索时不增加启动耗时。
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.logger import logger
+from database import AsyncSessionLocal
+from metrics import Counter, Gauge
+from models import Conversation, Message
+
+try:
+    import fcntl
+except ImportError:  # Windows：单进程开发环境，不需要跨进程加锁
+    fcntl = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认只在配置了嵌入模型时启用；哈希向量只反映字面相似度，需要时显式设置 RETRIEVAL_ENABLED=true
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true" if EMBEDDING_MODEL else "false").lower() == "true"
+# 相对路径按 backend 目录解析，与启动时的工作目录无关
+VECTOR_INDEX_DIR = os.path.join(BACKEND_DIR, os.getenv("VECTOR_INDEX_DIR", os.path.join("data", "vector_index")))
+# 注入的片段数和相似度下限
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.35"))
+# 片段最多占用的 token 数（同时不超过上下文预算的剩余部分）
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "500"))
+RETRIEVAL_SNIPPET_CHARS = int(os.getenv("RETRIEVAL_SNIPPET_CHARS", "300"))
+# 后台建索引：每批的消息数、轮询间隔（秒），以及只处理创建超过该时间（秒）的消息，
+# 避免并发事务按 id 乱序提交时漏掉消息
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_INDEX_INTERVAL = float(os.getenv("EMBEDDING_INDEX_INTERVAL", "5"))
+EMBEDDING_INDEX_LAG = float(os.getenv("EMBEDDING_INDEX_LAG", "2"))
+# 过短的消息（如“好的”）不建索引
+EMBEDDING_MIN_CHARS = 8
+
+embeddings_indexed = Counter("embeddings_indexed_total", "Messages added to the vector index")
+vector_index_size = Gauge("vector_index_vectors", "Vectors in this node's index")
+
+class EmbeddingIndexer:
+    """后台建索引的任务，同时负责只读 worker 的定期刷新"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = None
+        self.embedder = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.embedder is not None
+
+    def _try_become_writer(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, "index.lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+
+    async def start(self):
+        from services.embeddings import create_embedder
+        from services.vector_index import VectorIndex
+
+        self.index = VectorIndex(self.directory)
+        self.embedder = await asyncio.to_thread(create_embedder)
+        writer = self._try_become_writer()
+        await asyncio.to_thread(self.index.open, self.embedder.dim, self.embedder.name, writer)
+        vector_index_size.set(self.index.count)
+        logger.info(
+            "Vector index opened (%s, %s vectors, %s)",
+            self.embedder.name, self.index.count, "writer" if writer else "reader"
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.index.writable:
+                    while await self.index_pending() == EMBEDDING_BATCH_SIZE:
+                        pass
+                    if self.index.needs_training():
+                        await asyncio.to_thread(self.index.train)
+                elif self._try_become_writer():
+                    # 原写入方已退出，以可写方式重新打开
+                    await asyncio.to_thread(self.index.open, self.embedder.dim, self.embedder.name, True)
+                    logger.info("Took over vector index writing")
+                else:
+                    self.index.refresh()
+                vector_index_size.set(self.index.count)
+            except Exception as e:
+                logger.error("Vector indexing failed: %s", e)
+            await asyncio.sleep(EMBEDDING_INDEX_INTERVAL)
+
+    async def index_pending(self) -> int:
+        """为一批尚未索引的消息计算向量并写入，返回本批读取的消息数"""
+        cutoff = datetime.utcnow() - timedelta(seconds=EMBEDDING_INDEX_LAG)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Message.id, Message.conversation_id, Conversation.user_id, Message.content)
+                .join(Conversation, Conversation.id == Message.conversation_id)
+                .where(Message.id > self.index.last_message_id, Message.created_at <= cutoff)
+                .order_by(Message.id)
+                .limit(EMBEDDING_BATCH_SIZE)
+            )
+            rows = result.all()
+        if not rows:
+            return 0
+        batch = [row for row in rows if row.content and len(row.content.strip()) >= EMBEDDING_MIN_CHARS]
+        if batch:
+            vectors = await asyncio.to_thread(self.embedder.embed, [row.content for row in batch])
+            self.index.add(
+                [row.id for row in batch],
+                [row.conversation_id for row in batch],
+                [row.user_id for row in batch],
+                vectors
+            )
+            embeddings_indexed.inc(len(batch))
+        self.index.set_last_message_id(rows[-1].id)
+        return len(rows)
+
+embedding_indexer = EmbeddingIndexer(VECTOR_INDEX_DIR)
+
+def format_snippet(title: str, role: str, content: str) -> str:
+    content = " ".join(content.split())
+    if len(content) > RETRIEVAL_SNIPPET_CHARS:
+        content = content[:RETRIEVAL_SNIPPET_CHARS] + "…"
+    return f"[{title}] {role}: {content}"
+
+async def retrieve_snippets(db: AsyncSession, user_id: int, conversation_id: int, query: str) -> List[str]:
+    """与 query 最相关的其他对话片段（不含当前对话），按相似度降序，最多 RETRIEVAL_TOP_K 的两倍，
+    由调用方在 token 预算内选取"""
+    if not embedding_indexer.ready or not query.strip():
+        return []
+    vector = (await asyncio.to_thread(embedding_indexer.embedder.embed, [query]))[0]
+    hits = [
+        hit for hit in embedding_indexer.index.search(
+            user_id, vector, RETRIEVAL_TOP_K * 2, exclude_conversation_id=conversation_id
+        )
+        if hit.score >= RETRIEVAL_MIN_SCORE
+    ]
+    if not hits:
+        return []
+
+    result = await db.execute(
+        select(Message.id, Message.role, Message.content, Conversation.title)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.id.in_([hit.message_id for hit in hits]), Conversation.user_id == user_id)
+    )
+    found = {row.id: row for row in result.all()}
+    return [
+        format_snippet(found[hit.message_id].title, found[hit.message_id].role, found[hit.message_id].content)
+        for hit in hits if hit.message_id in found
+    ]
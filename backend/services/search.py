@@ -0,0 +1,187 @@
+"""消息内容和对话标题的全文检索。
+
+PostgreSQL：消息内容和标题都使用 to_tsvector 表达式 GIN 索引，查询中的表达式必须与索引一致。
+查询用 websearch_to_tsquery，按 ts_rank_cd 排序，ts_headline 生成摘要。
+SQLite（本地运行）：FTS5 外部内容表 messages_fts / conversations_fts（trigram 分词，可匹配中文子串），
+少于 3 个字符的词无法使用 trigram 索引，此时退化为 LIKE 匹配并按时间排序；消息摘要在 Python 中截取。
+
+索引由 PostgreSQL / 触发器在写入消息的同一事务中更新（迁移版本 6），发送消息、同步消息和更新标题时无需额外处理。
+"""
+import html
+import os
+import re
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# PostgreSQL 分词配置；中文内容需安装 zhparser 等扩展并配置对应的 text search configuration。
+# 表达式索引在迁移时按该配置建立，修改后需要重建 ix_messages_content_search 和 ix_conversations_title_search
+SEARCH_TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "simple")
+if not re.match(r"^[a-z_][a-z0-9_]*$", SEARCH_TS_CONFIG):
+    raise ValueError(f"Invalid SEARCH_TS_CONFIG: {SEARCH_TS_CONFIG}")
+
+# 标题命中的排序权重高于消息
+TITLE_WEIGHT = 2.0
+# 查询最多使用的词数
+MAX_TERMS = 10
+SNIPPET_CHARS = 80
+TRIGRAM_MIN_LENGTH = 3
+
+# 摘要中命中位置的标记，转义 HTML 后替换为 <mark>
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=35, MinWords=15, MaxFragments=2"
+
+def highlight(snippet: Optional[str]) -> str:
+    """转义摘要中的 HTML，只保留 <mark> 标记，客户端可以直接渲染"""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+def split_terms(query: str) -> List[str]:
+    return query.split()[:MAX_TERMS]
+
+def search(db: Session, user_id: int, query: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    """在用户自己的对话中检索，返回按相关度排序的消息和标题命中"""
+    terms = split_terms(query)
+    if not terms:
+        return []
+    window = offset + limit
+    if db.get_bind().dialect.name == "postgresql":
+        messages = _postgres_messages(db, user_id, query, window)
+        titles = _postgres_titles(db, user_id, query, window)
+    else:
+        messages = _sqlite_messages(db, user_id, terms, window)
+        titles = _sqlite_titles(db, user_id, terms, window)
+    results = [
+        {**row, "type": "message", "snippet": highlight(row["snippet"])} for row in messages
+    ] + [
+        {**row, "type": "conversation", "message_id": None, "role": None,
+         "snippet": highlight(row["snippet"]), "rank": row["rank"] * TITLE_WEIGHT}
+        for row in titles
+    ]
+    # 排序稳定：相关度相同时保持各自查询中的顺序（消息在前，均为新的在前）
+    results.sort(key=lambda result: result["rank"], reverse=True)
+    return results[offset:window]
+
+def _rows(db: Session, sql: str, **params) -> List[dict]:
+    return [dict(row._mapping) for row in db.execute(text(sql), params)]
+
+# PostgreSQL：先按相关度取出当前页的行，再只为这些行生成摘要
+def _postgres_messages(db: Session, user_id: int, query: str, limit: int) -> List[dict]:
+    return _rows(db, f"""
+        SELECT hit.message_id, hit.conversation_id, c.title, m.role, m.created_at, hit.rank,
+               ts_headline('{SEARCH_TS_CONFIG}', m.content, websearch_to_tsquery('{SEARCH_TS_CONFIG}', :query),
+                           :options) AS snippet
+        FROM (
+            SELECT m.id AS message_id, m.conversation_id,
+                   ts_rank_cd(to_tsvector('{SEARCH_TS_CONFIG}', m.content), q) AS rank
+            FROM messages m
+            JOIN conversations c ON c.id = m.conversation_id,
+                 websearch_to_tsquery('{SEARCH_TS_CONFIG}', :query) AS q
+            WHERE c.user_id = :user_id AND to_tsvector('{SEARCH_TS_CONFIG}', m.content) @@ q
+            ORDER BY rank DESC, m.id DESC
+            LIMIT :limit
+        ) AS hit
+        JOIN messages m ON m.id = hit.message_id
+        JOIN conversations c ON c.id = hit.conversation_id
+        ORDER BY hit.rank DESC, hit.message_id DESC
+    """, user_id=user_id, query=query, limit=limit, options=HEADLINE_OPTIONS)
+
+def _postgres_titles(db: Session, user_id: int, query: str, limit: int) -> List[dict]:
+    return _rows(db, f"""
+        SELECT c.id AS conversation_id, c.title, c.updated_at AS created_at,
+               ts_rank_cd(to_tsvector('{SEARCH_TS_CONFIG}', c.title), q) AS rank,
+               ts_headline('{SEARCH_TS_CONFIG}', c.title, q, :options) AS snippet
+        FROM conversations c, websearch_to_tsquery('{SEARCH_TS_CONFIG}', :query) AS q
+        WHERE c.user_id = :user_id AND to_tsvector('{SEARCH_TS_CONFIG}', c.title) @@ q
+        ORDER BY rank DESC, c.id DESC
+        LIMIT :limit
+    """, user_id=user_id, query=query, limit=limit, options=HEADLINE_OPTIONS)
+
+# SQLite FTS5
+def fts_query(terms: List[str]) -> str:
+    """每个词作为一个短语（转义引号），词之间为 AND，避免用户输入被解析为 FTS5 语法"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def like_conditions(column: str, terms: List[str]):
+    conditions = " AND ".join(f"{column} LIKE :term{i} ESCAPE '\\'" for i in range(len(terms)))
+    params = {
+        f"term{i}": "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        for i, term in enumerate(terms)
+    }
+    return conditions, params
+
+def make_snippet(content: str, terms: List[str]) -> str:
+    """在 Python 中截取第一个命中词附近的内容并标记所有命中词。
+
+    FTS5 的 snippet() 在 trigram 分词下按三字组计数，截出的片段只有十几个字符，因此 SQLite 不使用它。
+    """
+    lowered = content.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    first = min((pos for pos in positions if pos >= 0), default=0)
+    start = max(0, first - SNIPPET_CHARS // 4)
+    snippet = content[start:start + SNIPPET_CHARS]
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    snippet = pattern.sub(lambda match: HIGHLIGHT_START + match.group(0) + HIGHLIGHT_STOP, snippet)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + SNIPPET_CHARS < len(content) else ""
+    return prefix + snippet + suffix
+
+def _uses_trigram_index(terms: List[str]) -> bool:
+    return all(len(term) >= TRIGRAM_MIN_LENGTH for term in terms)
+
+def _sqlite_messages(db: Session, user_id: int, terms: List[str], limit: int) -> List[dict]:
+    if _uses_trigram_index(terms):
+        rows = _rows(db, """
+            SELECT m.id AS message_id, m.conversation_id, c.title, m.role, m.created_at,
+                   -bm25(messages_fts) AS rank, m.content AS snippet
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE messages_fts MATCH :query AND c.user_id = :user_id
+            ORDER BY rank DESC, m.id DESC
+            LIMIT :limit
+        """, query=fts_query(terms), user_id=user_id, limit=limit)
+        for row in rows:
+            row["snippet"] = make_snippet(row["snippet"], terms)
+        return rows
+    conditions, params = like_conditions("messages_fts.content", terms)
+    rows = _rows(db, f"""
+        SELECT m.id AS message_id, m.conversation_id, c.title, m.role, m.created_at, 0.0 AS rank,
+               m.content AS snippet
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN conversations c ON c.id = m.conversation_id
+        WHERE {conditions} AND c.user_id = :user_id
+        ORDER BY m.id DESC
+        LIMIT :limit
+    """, user_id=user_id, limit=limit, **params)
+    for row in rows:
+        row["snippet"] = make_snippet(row["snippet"], terms)
+    return rows
+
+def _sqlite_titles(db: Session, user_id: int, terms: List[str], limit: int) -> List[dict]:
+    if _uses_trigram_index(terms):
+        return _rows(db, """
+            SELECT c.id AS conversation_id, c.title, c.updated_at AS created_at,
+                   -bm25(conversations_fts) AS rank,
+                   highlight(conversations_fts, 0, char(2), char(3)) AS snippet
+            FROM conversations_fts
+            JOIN conversations c ON c.id = conversations_fts.rowid
+            WHERE conversations_fts MATCH :query AND c.user_id = :user_id
+            ORDER BY rank DESC, c.id DESC
+            LIMIT :limit
+        """, query=fts_query(terms), user_id=user_id, limit=limit)
+    conditions, params = like_conditions("conversations_fts.title", terms)
+    rows = _rows(db, f"""
+        SELECT c.id AS conversation_id, c.title, c.updated_at AS created_at, 0.0 AS rank, c.title AS snippet
+        FROM conversations_fts
+        JOIN conversations c ON c.id = conversations_fts.rowid
+        WHERE {conditions} AND c.user_id = :user_id
+        ORDER BY c.id DESC
+        LIMIT :limit
+    """, user_id=user_id, limit=limit, **params)
+    for row in rows:
+        row["snippet"] = make_snippet(row["snippet"], terms)
+    return rows
@@ -0,0 +1,240 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.logger import logger, request_id_var
+from database import AsyncSessionLocal
+from metrics import Counter, Gauge
+from models import Conversation, Message, SummaryJob, User
+from services.llm import LLM_SUMMARY_TEMPERATURE, resolve_provider
+from services.llm_cache import cached
+from services.llm_limiter import limited
+from services.llm_timing import timed
+
+# 对话达到该条数时开始自动生成标题，此后每条新消息都会刷新，直到达到 SUMMARY_TITLE_MESSAGES 条
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "3"))
+# 只使用前几条消息生成标题
+SUMMARY_TITLE_MESSAGES = 5
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_JOB_MAX_ATTEMPTS = int(os.getenv("SUMMARY_JOB_MAX_ATTEMPTS", "3"))
+SUMMARY_JOB_RETRY_DELAY = float(os.getenv("SUMMARY_JOB_RETRY_DELAY", "5"))
+# 超过该时间（秒）仍处于 running 的任务视为所在进程已退出，启动时重新排队
+SUMMARY_JOB_STALE_SECONDS = float(os.getenv("SUMMARY_JOB_STALE_SECONDS", "300"))
+
+TITLE_SYSTEM_PROMPT = "你是一个专业的对话总结助手。请根据以下对话内容，生成一个简洁的标题（不超过10个字）。标题应该概括对话的主要主题。"
+
+ACTIVE_STATUSES = ("pending", "running")
+
+summary_jobs_enqueued = Counter("summary_jobs_enqueued_total", "Title summarization jobs created")
+summary_jobs_coalesced = Counter("summary_jobs_coalesced_total", "Title requests merged into an existing job or title")
+summary_jobs_completed = Counter("summary_jobs_completed_total", "Title summarization jobs that finished")
+summary_jobs_failed = Counter("summary_jobs_failed_total", "Title summarization jobs that gave up")
+summary_jobs_queued = Gauge("summary_jobs_queued", "Title summarization jobs waiting for a worker")
+
+# 标题更新通知，参数为 (user_id, conversation_id, title)
+TitleListener = Callable[[int, int, str], Awaitable[None]]
+title_listeners: List[TitleListener] = []
+
+def add_title_listener(listener: TitleListener):
+    title_listeners.append(listener)
+
+async def notify_title(user_id: int, conversation_id: int, title: str):
+    for listener in title_listeners:
+        try:
+            await listener(user_id, conversation_id, title)
+        except Exception as e:
+            logger.warning("标题更新通知失败: %s", e)
+
+def build_title_prompt(messages: List[dict]) -> List[dict]:
+    conversation_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    return [
+        {"role": "system", "content": TITLE_SYSTEM_PROMPT},
+        {"role": "user", "content": conversation_text}
+    ]
+
+async def get_latest_job(db: AsyncSession, conversation_id: int) -> Optional[SummaryJob]:
+    result = await db.execute(
+        select(SummaryJob).filter(
+            SummaryJob.conversation_id == conversation_id
+        ).order_by(SummaryJob.id.desc()).limit(1)
+    )
+    return result.scalars().first()
+
+class SummaryWorkerPool:
+    """进程内的标题生成 worker。
+
+    任务先写入 summary_jobs 表，再把 id 放进内存队列；worker 以条件更新
+    (status pending -> running) 认领任务，多个进程同时恢复同一批任务时只有一个能执行。
+    调用模型期间不持有数据库会话。
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, job_id: int):
+        if self._queue is None:
+            # 尚未启动（如脚本中调用），任务保留在表中，下次启动时恢复
+            return
+        self._queue.put_nowait(job_id)
+        summary_jobs_queued.set(self._queue.qsize())
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        stale_before = datetime.utcnow() - timedelta(seconds=SUMMARY_JOB_STALE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(SummaryJob).where(
+                    SummaryJob.status == "running",
+                    SummaryJob.updated_at < stale_before
+                ).values(status="pending")
+            )
+            await db.commit()
+            result = await db.execute(
+                select(SummaryJob.id).filter(SummaryJob.status == "pending").order_by(SummaryJob.id)
+            )
+            pending = result.scalars().all()
+        for job_id in pending:
+            self.submit(job_id)
+        if pending:
+            logger.info("恢复了 %s 个未完成的标题生成任务", len(pending))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            summary_jobs_queued.set(self._queue.qsize())
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                logger.error("标题生成任务 %s 异常: %s", job_id, e)
+
+    async def _claim(self, job_id: int) -> bool:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(SummaryJob).where(
+                    SummaryJob.id == job_id,
+                    SummaryJob.status == "pending"
+                ).values(
+                    status="running",
+                    attempts=SummaryJob.attempts + 1,
+                    updated_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    async def _finish(self, job_id: int, **values):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SummaryJob).where(SummaryJob.id == job_id).values(**values))
+            await db.commit()
+
+    async def run_job(self, job_id: int):
+        # 任务的日志以任务 id 关联
+        request_id_var.set(f"summary-job-{job_id}")
+        if not await self._claim(job_id):
+            return
+
+        async with AsyncSessionLocal() as db:
+            job = await db.get(SummaryJob, job_id)
+            conversation = await db.get(Conversation, job.conversation_id)
+            user = await db.get(User, job.user_id)
+            result = await db.execute(
+                select(Message.role, Message.content).filter(
+                    Message.conversation_id == job.conversation_id
+                ).order_by(Message.created_at, Message.id).limit(SUMMARY_TITLE_MESSAGES)
+            )
+            messages = [{"role": role, "content": content} for role, content in result.all()]
+            attempts = job.attempts
+            use_cache = job.use_cache
+
+        if conversation is None or user is None:
+            await self._finish(job_id, status="failed", error="conversation not found")
+            summary_jobs_failed.inc()
+            return
+
+        try:
+            provider = timed(cached(limited(resolve_provider(conversation, user), user.id), use_cache))
+            response = await provider.complete(build_title_prompt(messages), temperature=LLM_SUMMARY_TEMPERATURE)
+        except Exception as e:
+            if attempts >= SUMMARY_JOB_MAX_ATTEMPTS:
+                logger.error("对话 %s 的标题生成失败: %s", conversation.id, e)
+                await self._finish(job_id, status="failed", error=str(e))
+                summary_jobs_failed.inc()
+            else:
+                logger.warning("对话 %s 的标题生成失败，稍后重试: %s", conversation.id, e)
+                await self._finish(job_id, status="pending", error=str(e))
+                asyncio.get_running_loop().call_later(SUMMARY_JOB_RETRY_DELAY, self.submit, job_id)
+            return
+
+        new_title = response.strip()
+        async with AsyncSessionLocal() as db:
+            # 同一对话的较新任务（基于更多消息）已先完成时，不用本任务的结果覆盖标题
+            newer_done = select(SummaryJob.id).where(
+                SummaryJob.conversation_id == conversation.id,
+                SummaryJob.id > job_id,
+                SummaryJob.status == "done"
+            ).exists()
+            result = await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation.id, ~newer_done)
+                .values(title=new_title)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                update(SummaryJob).where(SummaryJob.id == job_id).values(
+                    status="done", title=new_title, message_count=len(messages), error=None
+                )
+            )
+            await db.commit()
+        summary_jobs_completed.inc()
+        if result.rowcount == 1:
+            logger.info("对话 %s 的标题已更新: %s", conversation.id, new_title)
+            await notify_title(user.id, conversation.id, new_title)
+
+summary_workers = SummaryWorkerPool(SUMMARY_WORKERS)
+
+async def enqueue_summary(
+    db: AsyncSession,
+    conversation_id: int,
+    user_id: int,
+    message_count: int,
+    use_cache: bool = True
+) -> SummaryJob:
+    """为对话创建标题生成任务。
+
+    对话已有排队中的任务（执行时才读取消息），或已有基于相同消息条数生成的标题时，直接返回已有任务。
+    正在执行的任务已读取了消息，不合并，另建任务以包含新消息。
+    """
+    basis = min(message_count, SUMMARY_TITLE_MESSAGES)
+    latest = await get_latest_job(db, conversation_id)
+    if latest is not None and (
+        latest.status == "pending"
+        or (latest.status == "done" and latest.message_count >= basis)
+    ):
+        summary_jobs_coalesced.inc()
+        return latest
+
+    job = SummaryJob(
+        conversation_id=conversation_id,
+        user_id=user_id,
+        message_count=basis,
+        use_cache=use_cache
+    )
+    db.add(job)
+    await db.commit()
+    summary_jobs_enqueued.inc()
+    summary_workers.submit(job.id)
+    return job
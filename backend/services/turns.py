@@ -0,0 +1,138 @@
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.logger import logger
+from instrumentation import measure_stage
+from models import Conversation, Message
+from services.context import build_context
+from services.conversation_stats import stats_update
+from services.history_cache import history_cache, history_cache_hits, history_cache_misses, to_cache_entry
+from services.llm import LLMProvider, resolve_provider
+from services.llm_cache import cached
+from services.llm_limiter import limited
+from services.llm_timing import timed
+from services.summary_jobs import SUMMARY_TITLE_MESSAGES, SUMMARY_TRIGGER_MESSAGES, enqueue_summary
+
+# 新消息通知，参数为 (user_id, 序列化后的消息)
+MessageListener = Callable[[int, dict], Awaitable[None]]
+message_listeners: List[MessageListener] = []
+
+def add_message_listener(listener: MessageListener):
+    message_listeners.append(listener)
+
+async def notify_message(user_id: int, message: dict):
+    for listener in message_listeners:
+        try:
+            await listener(user_id, message)
+        except Exception as e:
+            logger.warning("新消息通知失败: %s", e)
+
+def serialize_message(msg: Message) -> dict:
+    return {
+        "id": msg.id,
+        "conversation_id": msg.conversation_id,
+        "role": msg.role,
+        "content": msg.content,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None,
+    }
+
+async def get_user_conversation(
+    db: AsyncSession,
+    conversation_id: int,
+    user_id: int
+) -> Optional[Conversation]:
+    """获取属于指定用户的对话"""
+    result = await db.execute(
+        select(Conversation).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        )
+    )
+    return result.scalars().first()
+
+def history_version(conversation_id: int):
+    """对话当前的 (消息数, 最后一条消息 id)，用于校验缓存的历史是否完整"""
+    last_id = (
+        select(Message.id)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    return select(Conversation.message_count, last_id).where(Conversation.id == conversation_id)
+
+def is_current(messages: List[dict], message_count: Optional[int], last_id: Optional[int]) -> bool:
+    return len(messages) == message_count and (messages[-1]["id"] if messages else None) == last_id
+
+async def get_history_entries(db: AsyncSession, conversation_id: int) -> List[dict]:
+    """获取对话的历史消息（含 id），优先读取缓存，未命中时从数据库加载并写入缓存。
+
+    缓存的历史与对话的消息数和最后一条消息 id 对照：其他 worker 写入或删除了消息、
+    或者加载与追加并发导致缓存缺少或重复消息时，视为未命中并重新加载。
+    """
+    with measure_stage("history"):
+        messages = await history_cache.get(conversation_id)
+        if messages is not None:
+            message_count, last_id = (await db.execute(history_version(conversation_id))).one()
+            if not is_current(messages, message_count, last_id):
+                messages = None
+        if messages is not None:
+            history_cache_hits.inc()
+        else:
+            history_cache_misses.inc()
+            result = await db.execute(
+                select(Message).filter(
+                    Message.conversation_id == conversation_id
+                ).order_by(Message.created_at, Message.id)
+            )
+            messages = [to_cache_entry(msg) for msg in result.scalars().all()]
+            await history_cache.set(conversation_id, messages)
+    return messages
+
+async def save_message(db: AsyncSession, user_id: int, conversation_id: int, role: str, content: str) -> Message:
+    """保存一条消息并在同一事务中更新对话统计，追加到历史缓存并通知订阅方"""
+    message = Message(
+        content=content,
+        role=role,
+        conversation_id=conversation_id
+    )
+    db.add(message)
+    with measure_stage("commit"):
+        await db.flush()
+        await db.execute(stats_update(conversation_id, [message]))
+        await db.commit()
+        await db.refresh(message)
+    await history_cache.append(conversation_id, [to_cache_entry(message)])
+    await notify_message(user_id, serialize_message(message))
+    return message
+
+async def prepare_turn(
+    db: AsyncSession,
+    conversation: Conversation,
+    user,
+    content: str,
+    use_cache: bool = True
+) -> Tuple[Message, LLMProvider, List[dict]]:
+    """保存用户消息并构建本轮请求，返回 (用户消息, provider, 发送给模型的消息)。
+
+    返回前结束 db 上的事务、归还连接，调用模型期间不占用连接池；
+    回复应使用新的会话保存。
+    """
+    user_message = await save_message(db, user.id, conversation.id, "user", content)
+    logger.info("用户消息已保存: %s", user_message.id)
+
+    # 获取对话历史，在 token 预算内构建 OpenAI 请求
+    history = await get_history_entries(db, conversation.id)
+    logger.info("获取到 %s 条历史消息", len(history))
+    # 前几条消息变化时在后台刷新标题，不阻塞本轮回复
+    if SUMMARY_TRIGGER_MESSAGES <= len(history) <= SUMMARY_TITLE_MESSAGES:
+        await enqueue_summary(db, conversation.id, user.id, len(history))
+    provider = limited(resolve_provider(conversation, user), user.id)
+    openai_messages = await build_context(db, conversation, history, provider)
+    # 首轮提问（上下文只有这一条用户消息）与用户无关，相同的问题可以直接复用回复
+    if len(openai_messages) == 1:
+        provider = cached(provider, use_cache)
+    await db.commit()
+    return user_message, timed(provider), openai_messages
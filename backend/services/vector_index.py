@@ -0,0 +1,317 @@
+"""磁盘上的向量索引（numpy memmap），按用户分区检索。
+
+文件（VECTOR_INDEX_DIR 下）：
+- vectors.f32：capacity × dim 的 float32 向量，已 L2 归一化
+- rows.i64：capacity × 4 的 (message_id, conversation_id, user_id, IVF 列表号)
+- centroids.npy：IVF 粗量化中心，向量数达到 VECTOR_IVF_MIN_VECTORS 后训练
+- state.json：已写入的条数、维度、embedder 名称和已索引到的消息 id
+
+文件只追加，state.json 最后原子替换，读取方只看到完整写入的前缀。
+检索只在当前用户的向量中进行：用户向量较少时精确计算，较多时只扫描最近的几个 IVF 列表。
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from config.logger import logger
+from metrics import Histogram
+
+# 用户向量数超过该值且已训练 IVF 时改为近似检索
+VECTOR_EXACT_SEARCH_LIMIT = int(os.getenv("VECTOR_EXACT_SEARCH_LIMIT", "20000"))
+# 总向量数达到该值后训练 IVF，之后每增长一倍重新训练
+VECTOR_IVF_MIN_VECTORS = int(os.getenv("VECTOR_IVF_MIN_VECTORS", "100000"))
+VECTOR_IVF_LISTS = int(os.getenv("VECTOR_IVF_LISTS", "1024"))
+# 每次检索扫描的 IVF 列表数
+VECTOR_IVF_PROBES = int(os.getenv("VECTOR_IVF_PROBES", "16"))
+
+ROW_MESSAGE, ROW_CONVERSATION, ROW_USER, ROW_LIST = range(4)
+UNASSIGNED = -1
+MIN_CAPACITY = 1024
+# 训练和分配 IVF 列表时每批计算的向量数
+ASSIGN_CHUNK = 65536
+
+vector_search_seconds = Histogram("vector_search_seconds", "Vector index search latency")
+
+class Hit(NamedTuple):
+    message_id: int
+    conversation_id: int
+    score: float
+
+class UserRows:
+    """一个用户在索引中的行号，按追加顺序保存在可增长的数组中"""
+
+    def __init__(self):
+        self.rows = np.empty(16, dtype=np.int64)
+        self.size = 0
+        # IVF 检索用：按列表号排序的行号及各列表的起点，只覆盖前 grouped_size 行
+        self.sorted_rows: Optional[np.ndarray] = None
+        self.list_starts: Optional[np.ndarray] = None
+        self.grouped_size = 0
+
+    def extend(self, rows: np.ndarray):
+        needed = self.size + len(rows)
+        if needed > len(self.rows):
+            grown = np.empty(max(needed, len(self.rows) * 2), dtype=np.int64)
+            grown[:self.size] = self.rows[:self.size]
+            self.rows = grown
+        self.rows[self.size:needed] = rows
+        self.size = needed
+
+    def view(self) -> np.ndarray:
+        return self.rows[:self.size]
+
+class VectorIndex:
+    """只追加的向量索引；每个节点只有一个写入进程（见 services/retrieval.py），其他进程只读并定期 refresh"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.writable = False
+        self.dim = 0
+        self.embedder = ""
+        self.count = 0
+        self.last_message_id = 0
+        self.capacity = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._rows: Optional[np.ndarray] = None
+        self._users: Dict[int, UserRows] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._ivf_version = 0
+        self._state_mtime = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self, dim: int, embedder: str, writable: bool):
+        """打开或创建索引；embedder 或维度变化时（写入方）清空重建"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.writable = writable
+        state = self._read_state()
+        if state is not None and (state["dim"] != dim or state["embedder"] != embedder):
+            if not writable:
+                raise RuntimeError("Vector index was built with a different embedder")
+            logger.warning(
+                "Vector index embedder changed (%s -> %s), rebuilding", state["embedder"], embedder
+            )
+            for name in ("vectors.f32", "rows.i64", "centroids.npy", "state.json"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            state = None
+        self.dim = dim
+        self.embedder = embedder
+        self.count = 0
+        self.last_message_id = 0
+        self._users = {}
+        if state is None:
+            if writable:
+                self._ensure_capacity(MIN_CAPACITY)
+                self._write_state()
+            return
+        self._apply_state(state)
+
+    def _read_state(self) -> Optional[dict]:
+        try:
+            with open(self._path("state.json")) as f:
+                state = json.load(f)
+            self._state_mtime = os.path.getmtime(self._path("state.json"))
+            return state
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self):
+        state = {
+            "dim": self.dim,
+            "embedder": self.embedder,
+            "count": self.count,
+            "last_message_id": self.last_message_id,
+            "ivf_version": self._ivf_version,
+        }
+        tmp = self._path("state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._path("state.json"))
+
+    def _map(self, capacity: int):
+        mode = "r+" if self.writable else "r"
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        self._rows = np.memmap(self._path("rows.i64"), dtype=np.int64, mode=mode, shape=(capacity, 4))
+        self.capacity = capacity
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, self.capacity * 2, MIN_CAPACITY)
+        for name, row_bytes in (("vectors.f32", self.dim * 4), ("rows.i64", 32)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._map(capacity)
+
+    def _apply_state(self, state: dict):
+        """映射新写入的部分，并把新增行加入各用户的行号"""
+        count = state["count"]
+        if count > self.capacity:
+            capacity = os.path.getsize(self._path("rows.i64")) // 32
+            self._map(capacity)
+        if state.get("ivf_version", 0) != self._ivf_version:
+            self._load_centroids(state.get("ivf_version", 0))
+        self._index_users(self.count, count)
+        self.count = count
+        self.last_message_id = state["last_message_id"]
+
+    def _index_users(self, start: int, end: int):
+        if end <= start:
+            return
+        users = np.asarray(self._rows[start:end, ROW_USER])
+        order = np.argsort(users, kind="stable")
+        sorted_users = users[order]
+        boundaries = np.flatnonzero(np.diff(sorted_users)) + 1
+        for group in np.split(order, boundaries):
+            user_id = int(users[group[0]])
+            self._users.setdefault(user_id, UserRows()).extend(group + start)
+
+    def _load_centroids(self, version: int):
+        path = self._path("centroids.npy")
+        self._centroids = np.load(path) if version and os.path.exists(path) else None
+        self._ivf_version = version
+        for user_rows in self._users.values():
+            user_rows.sorted_rows = None
+            user_rows.grouped_size = 0
+
+    def refresh(self):
+        """读取方：state.json 变化时映射新写入的向量"""
+        try:
+            mtime = os.path.getmtime(self._path("state.json"))
+        except FileNotFoundError:
+            return
+        if mtime == self._state_mtime:
+            return
+        state = self._read_state()
+        if state is None or state["dim"] != self.dim or state["embedder"] != self.embedder:
+            return
+        with self._lock:
+            self._apply_state(state)
+
+    def add(self, message_ids: List[int], conversation_ids: List[int], user_ids: List[int], vectors: np.ndarray):
+        """写入方：追加一批向量"""
+        n = len(message_ids)
+        if n == 0:
+            return
+        with self._lock:
+            start, end = self.count, self.count + n
+            self._ensure_capacity(end)
+            self._vectors[start:end] = vectors
+            self._rows[start:end, ROW_MESSAGE] = message_ids
+            self._rows[start:end, ROW_CONVERSATION] = conversation_ids
+            self._rows[start:end, ROW_USER] = user_ids
+            self._rows[start:end, ROW_LIST] = (
+                self._assign(vectors) if self._centroids is not None else UNASSIGNED
+            )
+            self._vectors.flush()
+            self._rows.flush()
+            self._index_users(start, end)
+            self.count = end
+
+    def set_last_message_id(self, message_id: int):
+        """写入方：记录已处理到的消息 id 并提交本批写入"""
+        self.last_message_id = message_id
+        self._write_state()
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def needs_training(self) -> bool:
+        if self.count < VECTOR_IVF_MIN_VECTORS:
+            return False
+        return self._centroids is None or self.count >= self._ivf_version * 2
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """写入方，在后台线程中调用：球面 k-means 训练 IVF 中心并重新分配所有向量"""
+        started = time.perf_counter()
+        count = self.count
+        lists = min(VECTOR_IVF_LISTS, max(1, count // 40))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(self._vectors[np.sort(rng.choice(count, min(count, lists * 40), replace=False))])
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            nonempty = norms[:, 0] > 0
+            centroids[nonempty] = sums[nonempty] / norms[nonempty]
+
+        assigned = np.empty(count, dtype=np.int64)
+        for start in range(0, count, ASSIGN_CHUNK):
+            end = min(start + ASSIGN_CHUNK, count)
+            assigned[start:end] = np.argmax(np.asarray(self._vectors[start:end]) @ centroids.T, axis=1)
+
+        np.save(self._path("centroids.tmp.npy"), centroids)
+        os.replace(self._path("centroids.tmp.npy"), self._path("centroids.npy"))
+        with self._lock:
+            self._rows[:count, ROW_LIST] = assigned
+            # 训练期间追加的向量按新的中心重新分配
+            if self.count > count:
+                self._rows[count:self.count, ROW_LIST] = np.argmax(
+                    np.asarray(self._vectors[count:self.count]) @ centroids.T, axis=1
+                )
+            self._rows.flush()
+            self._load_centroids(count)
+            self._write_state()
+        logger.info(
+            "Trained vector index IVF with %s lists over %s vectors in %.1fs",
+            lists, count, time.perf_counter() - started
+        )
+
+    def _candidates(self, user_rows: UserRows, query: np.ndarray) -> np.ndarray:
+        rows = user_rows.view()
+        if self._centroids is None or len(rows) <= VECTOR_EXACT_SEARCH_LIMIT:
+            return rows
+        # 按列表号分组的行号只在新增超过 10% 时重建，之后追加的行精确扫描
+        if user_rows.sorted_rows is None or len(rows) > user_rows.grouped_size * 1.1:
+            lists = np.asarray(self._rows[rows, ROW_LIST])
+            order = np.argsort(lists, kind="stable")
+            user_rows.sorted_rows = rows[order]
+            user_rows.list_starts = np.searchsorted(lists[order], np.arange(len(self._centroids) + 1))
+            user_rows.grouped_size = len(rows)
+        probes = min(VECTOR_IVF_PROBES, len(self._centroids))
+        nearest = np.argpartition(-(self._centroids @ query), probes - 1)[:probes]
+        starts = user_rows.list_starts
+        parts = [user_rows.sorted_rows[starts[i]:starts[i + 1]] for i in nearest]
+        parts.append(rows[user_rows.grouped_size:])
+        return np.sort(np.concatenate(parts))
+
+    def search(
+        self,
+        user_id: int,
+        query: np.ndarray,
+        k: int,
+        exclude_conversation_id: Optional[int] = None
+    ) -> List[Hit]:
+        """返回该用户最相似的 k 条消息（按相似度降序）"""
+        started = time.perf_counter()
+        try:
+            user_rows = self._users.get(user_id)
+            if user_rows is None or k <= 0:
+                return []
+            with self._lock:
+                candidates = self._candidates(user_rows, query)
+                vectors = self._vectors[candidates]
+                meta = self._rows[candidates]
+            scores = vectors @ query
+            if exclude_conversation_id is not None:
+                scores[meta[:, ROW_CONVERSATION] == exclude_conversation_id] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            return [
+                Hit(int(meta[i, ROW_MESSAGE]), int(meta[i, ROW_CONVERSATION]), float(scores[i]))
+                for i in top if scores[i] > -np.inf
+            ]
+        finally:
+            vector_search_seconds.observe(time.perf_counter() - started)
@@ -7,8 +7,22 @@ ulimit -n 65535
 cd backend
 python -m pip install -r requirements.txt
 
-# 启动后端（使用gunicorn，限制内存使用）
-gunicorn main:app --workers 1 --threads 1 --bind 0.0.0.0:8000 --timeout 120 --max-requests 1000 --max-requests-jitter 50 &
+# worker 数默认等于 CPU 核数，可用 WEB_CONCURRENCY 指定
+# 数据库连接池（按 worker 计算）
+# 每个 worker 持有同步、异步两个连接池，gunicorn_conf.py 把 DB_MAX_CONNECTIONS 均分给所有连接池，
+# 应小于 PostgreSQL 的 max_connections；也可直接设置 DB_POOL_SIZE / DB_MAX_OVERFLOW
+export DB_MAX_CONNECTIONS=${DB_MAX_CONNECTIONS:-80}
+export DB_POOL_TIMEOUT=${DB_POOL_TIMEOUT:-30}
+export DB_POOL_RECYCLE=${DB_POOL_RECYCLE:-1800}
+export DB_POOL_PRE_PING=${DB_POOL_PRE_PING:-true}
+export DB_STATEMENT_TIMEOUT_MS=${DB_STATEMENT_TIMEOUT_MS:-30000}
+
+# 迁移数据库并创建默认数据（worker 启动时只检查结构版本）
+python manage.py migrate
+python manage.py seed
+
+# 启动后端（gunicorn + uvicorn worker，配置见 gunicorn_conf.py）
+gunicorn main:app -c gunicorn_conf.py &
 
 # 安装Node依赖并构建前端
 cd ../frontend